@@ -3,7 +3,7 @@ from typing import Any, List
 
 import tornado.web
 
-from pinnwand import handler, logger, path
+from pinnwand import handler, logger, path, utility
 from pinnwand.configuration import Configuration, ConfigurationProvider
 
 log = logger.get_logger(__name__)
@@ -14,6 +14,9 @@ def make_application(debug: bool = False) -> tornado.web.Application:
         load_env=True
     )
 
+    # Build the list of lexers up front instead of on the first request
+    utility.list_languages_json()
+
     pages: List[Any] = [
         (r"/", handler.website.Create),
         (r"/\+(.*)", handler.website.Create),
@@ -92,7 +95,8 @@ def make_application(debug: bool = False) -> tornado.web.Application:
             tornado.web.StaticFileHandler,
             {"path": path.static},
         ),
-        (r"/(.*)(?:#.+)?", handler.website.Show),
+        # Anything that isn't a slug is left to the default handler
+        (r"/([A-Z2-7]+)(?:#.+)?", handler.website.Show),
     ]
 
     app = tornado.web.Application(
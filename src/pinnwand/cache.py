@@ -0,0 +1,605 @@
+"""In-process caches of pastes and of the pages that show them. Pastes don't
+change after they are created so pages that show them can be served from
+memory instead of going to the database, and rendering, for every view.
+
+Every process has its own caches, removing a paste only invalidates the
+caches of the process that removed it. Entries are therefore kept for at most
+`cache_ttl` seconds and never past the expiry date of their paste."""
+
+import asyncio
+import functools
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    cast,
+)
+
+from pinnwand import logger
+from pinnwand.configuration import Configuration, ConfigurationProvider
+from pinnwand.database import manager, models, queries
+
+log = logger.get_logger(__name__)
+
+T = TypeVar("T")
+
+# Rough size in bytes of a paste or file without its text, used to account for
+# pastes with many small files.
+OVERHEAD = 512
+
+
+class LRUCache:
+    """A least recently used cache bounded by the total size of its values,
+    every entry also has a time after which it's no longer returned."""
+
+    def __init__(
+        self, on_remove: Optional[Callable[[Hashable, Any], None]] = None
+    ) -> None:
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float, int]]" = (
+            OrderedDict()
+        )
+        self._size = 0
+        self._lock = threading.Lock()
+        self._on_remove = on_remove
+
+        self.hits = 0
+        self.misses = 0
+
+        # Bumped on every removal, so values loaded from before a removal
+        # aren't stored after it.
+        self.generation = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the value for a key if it's in the cache and hasn't
+        expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires, _ = entry
+
+            if expires <= time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def put(
+        self,
+        key: Hashable,
+        value: Any,
+        size: int,
+        expires: float,
+        generation: Optional[int] = None,
+    ) -> bool:
+        """Store a value that takes up `size` bytes until `expires`. The least
+        recently used values are dropped to make room. When a `generation` is
+        given the value is only stored if nothing was removed since. Returns
+        whether the value was stored."""
+        configuration: Configuration = ConfigurationProvider.get_config()
+
+        # Values that don't fit at all aren't going to push everything else
+        # out of the cache.
+        if size > configuration.cache_size:
+            return False
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+
+            self._remove(key)
+
+            self._entries[key] = (value, expires, size)
+            self._size += size
+
+            while self._size > configuration.cache_size:
+                self._remove(next(iter(self._entries)))
+
+        return True
+
+    def remove(self, key: Hashable) -> None:
+        """Drop a value from the cache, if it's in there."""
+        with self._lock:
+            self.generation += 1
+            self._remove(key)
+
+    def clear(self) -> None:
+        """Drop everything from the cache and reset the counters."""
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return the counters of the cache."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "size": self._size,
+            }
+
+    def _remove(self, key: Hashable) -> None:
+        """Drop a value, the lock must be held."""
+        entry = self._entries.pop(key, None)
+
+        if entry is None:
+            return
+
+        value, _, size = entry
+
+        self._size -= size
+
+        if self._on_remove:
+            self._on_remove(key, value)
+
+
+def expires(paste: models.Paste) -> float:
+    """Return the time until which a paste can be cached."""
+    configuration: Configuration = ConfigurationProvider.get_config()
+
+    return min(
+        time.time() + configuration.cache_ttl, paste.exp_date.timestamp()
+    )
+
+
+class PasteCache:
+    """A cache of detached pastes with all their files and of detached files
+    with their paste, bounded by the size of their text.
+
+    Pastes are cached with only the raw text of their files, or with their
+    highlighted text as well when they are shown. A paste with both serves
+    requests for only the raw text too. Files are cached on their own with
+    only their raw text, so requests for one file don't load the others."""
+
+    # Slugs of pastes that are cached with their highlighted text
+    _formatted: Set[str] = set()
+
+    # Slugs of pastes to the slugs of their files that are cached
+    _files: Dict[str, Set[str]] = {}
+
+    @staticmethod
+    def _forget(key: Hashable, value: Any) -> None:
+        kind, slug, *rest = cast(Tuple[Any, ...], key)
+
+        if kind == "paste":
+            if rest[0]:
+                PasteCache._formatted.discard(slug)
+            return
+
+        slugs = PasteCache._files.get(value.paste.slug)
+
+        if slugs is not None:
+            slugs.discard(slug)
+
+            if not slugs:
+                del PasteCache._files[value.paste.slug]
+
+    _cache = LRUCache(on_remove=_forget)
+
+    @classmethod
+    def size_of_file(cls, file: models.File, fmt: bool = True) -> int:
+        """Estimate the amount of memory a file takes up, text is kept as it
+        was stored. The highlighted text only counts with `fmt`."""
+        size = (
+            OVERHEAD
+            + len(file.raw_text or "")
+            + len(file.raw_data or b"")
+            + len(file.line_index or b"")
+        )
+
+        if fmt:
+            size += len(file.fmt_text or "") + len(file.fmt_data or b"")
+
+        return size
+
+    @classmethod
+    def size_of(cls, paste: models.Paste, fmt: bool = True) -> int:
+        """Estimate the amount of memory a paste takes up, see
+        `size_of_file`."""
+        return OVERHEAD + sum(
+            cls.size_of_file(file, fmt) for file in paste.files
+        )
+
+    @classmethod
+    def get(cls, slug: str, fmt: bool = True) -> Optional[models.Paste]:
+        """Return the paste for a slug if it's in the cache, with the
+        highlighted text of its files if `fmt` is asked for."""
+        fmt = fmt or slug in cls._formatted
+        return cls._cache.get(("paste", slug, fmt))
+
+    @classmethod
+    def get_file(cls, slug: str) -> Optional[models.File]:
+        """Return the file for a slug if it's in the cache."""
+        return cls._cache.get(("file", slug))
+
+    @classmethod
+    def generation(cls) -> int:
+        """Return the current generation of the cache, see `put`."""
+        return cls._cache.generation
+
+    @classmethod
+    def put(
+        cls,
+        paste: models.Paste,
+        generation: Optional[int] = None,
+        fmt: bool = True,
+    ) -> None:
+        """Store a paste, it must have its files and their raw text loaded
+        and their highlighted text too with `fmt`. If a `generation` is given
+        the paste isn't stored when anything was invalidated since that
+        generation."""
+        if cls._cache.put(
+            ("paste", paste.slug, fmt),
+            paste,
+            cls.size_of(paste, fmt),
+            expires(paste),
+            generation,
+        ):
+            if fmt:
+                cls._formatted.add(paste.slug)
+
+    @classmethod
+    def put_file(
+        cls, file: models.File, generation: Optional[int] = None
+    ) -> None:
+        """Store a file, it must have its paste and its raw text loaded. See
+        `put` for `generation`."""
+        if cls._cache.put(
+            ("file", file.slug),
+            file,
+            cls.size_of_file(file, False),
+            expires(file.paste),
+            generation,
+        ):
+            cls._files.setdefault(file.paste.slug, set()).add(file.slug)
+
+    @classmethod
+    def invalidate(cls, slug: str) -> None:
+        """Drop a paste and its files from the cache, if they're in there."""
+        cls._cache.remove(("paste", slug, True))
+        cls._cache.remove(("paste", slug, False))
+
+        for file_slug in list(cls._files.get(slug, ())):
+            cls._cache.remove(("file", file_slug))
+
+    @classmethod
+    def clear(cls) -> None:
+        """Drop everything from the cache and reset the counters."""
+        cls._cache.clear()
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        """Return the counters of the cache."""
+        return cls._cache.stats()
+
+
+class Page(NamedTuple):
+    """A response body and the dates of the paste it belongs to."""
+
+    body: bytes
+    pub_date: datetime
+    exp_date: datetime
+
+
+class PageCache:
+    """A cache of response bodies for pastes, such as their rendered page or
+    the raw text of one of their files, in each of the encodings they were
+    sent in. Cached bodies are shared between visitors and can't contain
+    anything specific to one of them."""
+
+    # Slugs of pastes to the keys of their cached bodies
+    _keys: Dict[str, Set[Tuple[str, ...]]] = {}
+
+    @staticmethod
+    def _forget_key(key: Hashable, page: Page) -> None:
+        # Only keys made by `put` are stored
+        page_key = cast(Tuple[str, ...], key)
+        keys = PageCache._keys.get(page_key[0])
+
+        if keys is not None:
+            keys.discard(page_key)
+
+            if not keys:
+                del PageCache._keys[page_key[0]]
+
+    _cache = LRUCache(on_remove=_forget_key)
+
+    @classmethod
+    def fits(cls, size: int) -> bool:
+        """Would a body of `size` bytes be stored at all?"""
+        configuration: Configuration = ConfigurationProvider.get_config()
+
+        return OVERHEAD + size <= configuration.cache_size
+
+    @classmethod
+    def get(cls, slug: str, name: str, encoding: str) -> Optional[Page]:
+        """Return the body by `name` for the paste by `slug` in an encoding if
+        it's in the cache."""
+        return cls._cache.get((slug, name, encoding))
+
+    @classmethod
+    def generation(cls) -> int:
+        """Return the current generation of the cache, see `put`."""
+        return cls._cache.generation
+
+    @classmethod
+    def put(
+        cls,
+        paste: models.Paste,
+        name: str,
+        encoding: str,
+        body: bytes,
+        generation: Optional[int] = None,
+    ) -> None:
+        """Store a body by `name` for a paste in an encoding. If a
+        `generation` is given the body isn't stored when anything was
+        invalidated since that generation."""
+        key = (paste.slug, name, encoding)
+
+        if cls._cache.put(
+            key,
+            Page(body, paste.pub_date, paste.exp_date),
+            OVERHEAD + len(body),
+            expires(paste),
+            generation,
+        ):
+            cls._keys.setdefault(paste.slug, set()).add(key)
+
+    @classmethod
+    def invalidate(cls, slug: str) -> None:
+        """Drop all bodies for a paste from the cache."""
+        for key in list(cls._keys.get(slug, ())):
+            cls._cache.remove(key)
+
+    @classmethod
+    def clear(cls) -> None:
+        """Drop everything from the cache and reset the counters."""
+        cls._cache.clear()
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        """Return the counters of the cache."""
+        return cls._cache.stats()
+
+
+class MissingCache:
+    """A cache of slugs that aren't pastes or files, so requests for them are
+    answered without a query. Slugs are kept for `cache_missing_ttl` seconds
+    as pastes created by other processes aren't known here."""
+
+    _cache = LRUCache()
+
+    @classmethod
+    def has(cls, slug: str) -> bool:
+        """Is a slug known to be missing?"""
+        return cls._cache.get(slug) is not None
+
+    @classmethod
+    def add(cls, slug: str) -> None:
+        """Remember that a slug is missing."""
+        configuration: Configuration = ConfigurationProvider.get_config()
+
+        cls._cache.put(
+            slug,
+            True,
+            OVERHEAD + len(slug),
+            time.time() + configuration.cache_missing_ttl,
+        )
+
+    @classmethod
+    def discard(cls, slug: str) -> None:
+        """Forget that a slug is missing."""
+        cls._cache.remove(slug)
+
+    @classmethod
+    def clear(cls) -> None:
+        """Drop everything from the cache and reset the counters."""
+        cls._cache.clear()
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        """Return the counters of the cache."""
+        return cls._cache.stats()
+
+
+def created(paste: models.Paste) -> None:
+    """Forget that the slugs of a new paste and its files were missing."""
+    MissingCache.discard(paste.slug)
+
+    for file in paste.files:
+        MissingCache.discard(file.slug)
+
+
+def invalidate(slug: str) -> None:
+    """Drop a paste and its pages from the caches and remember that it's
+    missing. Loads that are still running won't store what they loaded."""
+    PasteCache.invalidate(slug)
+    PageCache.invalidate(slug)
+    MissingCache.add(slug)
+
+
+def log_stats() -> None:
+    """Log the counters of the caches of this process."""
+    for name, cache in (
+        ("pastes", PasteCache),
+        ("pages", PageCache),
+        ("missing", MissingCache),
+    ):
+        stats = cache.stats()
+        log.info(
+            "cache: %s had %d hits and %d misses, holds %d entries of %d bytes",
+            name,
+            stats["hits"],
+            stats["misses"],
+            stats["entries"],
+            stats["size"],
+        )
+
+
+class SingleFlight:
+    """Coalesces concurrent loads of the same key. The first caller for a key
+    starts the load, everyone that asks for the same key while it's running
+    waits for that load instead of starting their own."""
+
+    def __init__(self) -> None:
+        self._flights: Dict[Hashable, "asyncio.Future[Any]"] = {}
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Return the result of `fn()`, or of the load for `key` that is
+        already running."""
+        flight = self._flights.get(key)
+
+        if flight is None:
+            flight = asyncio.ensure_future(fn())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda _: self._flights.pop(key, None))
+
+        # Shielded, a waiter that goes away doesn't cancel the load for the
+        # others.
+        return await asyncio.shield(flight)
+
+
+flights = SingleFlight()
+
+
+async def paste_by_slug(slug: str, fmt: bool = True) -> Optional[models.Paste]:
+    """Fetch a paste with the raw text of its files loaded by slug, and with
+    their highlighted text if `fmt` is asked for. The paste comes from the
+    cache if possible, concurrent misses for the same slug share a single
+    query."""
+
+    if MissingCache.has(slug):
+        return None
+
+    paste = PasteCache.get(slug, fmt)
+
+    if paste is None:
+        paste = await flights.run(
+            ("paste", slug, fmt), lambda: _load_paste(slug, fmt)
+        )
+
+    return paste
+
+
+async def _load_paste(slug: str, fmt: bool) -> Optional[models.Paste]:
+    configuration: Configuration = ConfigurationProvider.get_config()
+
+    generation = PasteCache.generation()
+
+    paste = await manager.DatabaseManager.run(
+        queries.paste_by_slug, slug, True, fmt
+    )
+
+    if paste is None and configuration.database_read_uri:
+        # A read replica can lag behind, only the primary can tell that the
+        # paste doesn't exist
+        paste = await manager.DatabaseManager.run(
+            functools.partial(queries.paste_by_slug, slug, True, fmt, False)
+        )
+
+    if not configuration.cache_size:
+        return paste
+
+    if paste is None:
+        MissingCache.add(slug)
+    else:
+        PasteCache.put(paste, generation, fmt)
+
+    return paste
+
+
+async def paste_meta_by_slug(slug: str) -> Optional[models.Paste]:
+    """Fetch a paste by slug without caring for the text of its files. The
+    paste comes from the cache if it's there, otherwise only the paste and
+    its files are loaded and nothing is cached."""
+
+    if MissingCache.has(slug):
+        return None
+
+    paste = PasteCache.get(slug, False)
+
+    if paste is None:
+        paste = await manager.DatabaseManager.run(
+            queries.paste_by_slug, slug, False, False
+        )
+
+    return paste
+
+
+async def file_meta_by_slug(slug: str) -> Optional[models.File]:
+    """Fetch a file and its paste by slug without caring for its text. The
+    file comes from the cache if it's there, otherwise only the file and its
+    paste are loaded and nothing is cached."""
+
+    if MissingCache.has(slug):
+        return None
+
+    file = PasteCache.get_file(slug)
+
+    if file is None:
+        file = await manager.DatabaseManager.run(
+            queries.file_by_slug, slug, False
+        )
+
+    return file
+
+
+async def file_by_slug(slug: str) -> Optional[models.File]:
+    """Fetch a file with its raw text loaded by slug, from the cache if
+    possible. On a miss only the file and its paste are loaded, concurrent
+    misses for the same slug share a single query."""
+
+    if MissingCache.has(slug):
+        return None
+
+    file = PasteCache.get_file(slug)
+
+    if file is None:
+        file = await flights.run(("file", slug), lambda: _load_file(slug))
+
+    return file
+
+
+async def _load_file(slug: str) -> Optional[models.File]:
+    configuration: Configuration = ConfigurationProvider.get_config()
+
+    generation = PasteCache.generation()
+
+    file = await manager.DatabaseManager.run(queries.file_by_slug, slug)
+
+    if file is None and configuration.database_read_uri:
+        file = await manager.DatabaseManager.run(
+            functools.partial(queries.file_by_slug, slug, True, False)
+        )
+
+    if not configuration.cache_size:
+        return file
+
+    if file is None:
+        MissingCache.add(slug)
+    else:
+        PasteCache.put_file(file, generation)
+
+    return file
@@ -48,24 +48,84 @@ def main(verbose: int, configuration_path: Optional[str]) -> None:
     default=False,
     help="To start tornado server in debug mode or not",
 )
-def http(port: int, debug: bool) -> None:
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=0),
+    help="Amount of processes to serve from, 0 for one per CPU.",
+)
+def http(port: int, debug: bool, workers: int) -> None:
     """Run pinnwand's HTTP server."""
-    from pinnwand import utility
+    import tornado.httpserver
+    import tornado.netutil
+    import tornado.process
+
+    from pinnwand import cache, compress, highlight, utility
     from pinnwand.app import make_application
 
     configuration: Configuration = ConfigurationProvider.get_config()
 
+    if (
+        configuration.storage_compression is not None
+        and configuration.storage_compression not in compress.methods()
+    ):
+        log.error(
+            "http: unsupported storage_compression %r",
+            configuration.storage_compression,
+        )
+        raise SystemExit(1)
+
+    if workers != 1:
+        if debug:
+            log.error("http: debug mode can't be used with multiple workers")
+            raise SystemExit(1)
+
+        if manager.DatabaseManager.is_memory():
+            log.error(
+                "http: an in-memory database can't be shared between workers"
+            )
+            raise SystemExit(1)
+
     # Reap expired pastes on startup (we might've been shut down for a while)
     utility.reap()
 
-    # Schedule reaping every 1800 seconds
-    reap_task = tornado.ioloop.PeriodicCallback(
-        utility.async_reap, configuration.reaping_periodicity
-    )
-    reap_task.start()
+    # Build the list of lexers before forking so the workers share it
+    utility.list_languages_json()
+
+    if workers == 1:
+        task_id = 0
+
+        application = make_application(debug)
+        application.listen(port, xheaders=True)
+    else:
+        sockets = tornado.netutil.bind_sockets(port)
 
-    application = make_application(debug)
-    application.listen(port, xheaders=True)
+        # Connections and process pools can't be shared with the children, let
+        # each of them create their own after forking.
+        manager.DatabaseManager.dispose()
+        highlight.HighlightManager.shutdown()
+        highlight.HighlightManager.share(workers or tornado.process.cpu_count())
+
+        task_id = tornado.process.fork_processes(workers)
+
+        application = make_application(debug)
+        server = tornado.httpserver.HTTPServer(application, xheaders=True)
+        server.add_sockets(sockets)
+
+    # Only a single worker needs to reap, schedule it every
+    # `reaping_periodicity` milliseconds
+    if task_id == 0:
+        reap_task = tornado.ioloop.PeriodicCallback(
+            utility.async_reap, configuration.reaping_periodicity
+        )
+        reap_task.start()
+
+    # Every worker has caches of its own, each logs their counters at the
+    # same period
+    stats_task = tornado.ioloop.PeriodicCallback(
+        cache.log_stats, configuration.reaping_periodicity
+    )
+    stats_task.start()
 
     tornado.ioloop.IOLoop.current().start()
 
@@ -97,6 +157,7 @@ def add(lexer: str) -> None:
 @click.option("--paste", help="database.Paste identifier.", required=True)
 def delete(paste: str) -> None:
     """Delete a paste from pinnwand's database."""
+    from pinnwand import cache
 
     with manager.DatabaseManager.get_session() as session:
         paste_object = (
@@ -112,6 +173,8 @@ def delete(paste: str) -> None:
         session.delete(paste_object)
         session.commit()
 
+        cache.invalidate(paste_object.slug)
+
         log.info("delete: paste %s deleted", paste_object)
 
 
@@ -130,28 +193,88 @@ def reap() -> None:
 def resyntax() -> None:
     """Rerun `pygments` over all files in the database to update their formatted
     output."""
-    import pygments.lexers
-    from pygments_better_html import BetterHtmlFormatter
+    from sqlalchemy.orm import undefer_group
 
-    from pinnwand import utility
+    from pinnwand import highlight
+
+    configuration: Configuration = ConfigurationProvider.get_config()
 
     with manager.DatabaseManager.get_session() as session:
-        files = session.query(models.File).all()
+        files = session.query(models.File).options(undefer_group("raw")).all()
 
         for file in files:
-            if file.lexer == "autodetect":
-                lexer = utility.guess_language(file.raw, file.filename)
-                log.debug(f"resyntax: Language guessed as {lexer}")
+            file.fmt = highlight.render(
+                file.raw,
+                file.lexer,
+                file.filename,
+                wall_time=configuration.highlight_wall_time,
+                cpu_time=configuration.highlight_cpu_time,
+            )
 
-            lexer = pygments.lexers.get_lexer_by_name(lexer)
-            formatter = BetterHtmlFormatter(  # pylint: disable=no-member
-                linenos="table", cssclass="source"
+        session.commit()
+
+        log.info("resyntax: highlighted %d pastes", len(files))
+
+
+@main.command()
+@click.option(
+    "--batch-size",
+    default=1000,
+    type=click.IntRange(min=1),
+    help="Amount of files to convert per transaction.",
+)
+def compress(batch_size: int) -> None:
+    """Convert the text of all files in the database to the configured
+    `storage_compression`, or back to plain text when it isn't set."""
+    from sqlalchemy import or_
+    from sqlalchemy.orm import undefer_group
+
+    from pinnwand.compress import methods
+
+    configuration: Configuration = ConfigurationProvider.get_config()
+    method = configuration.storage_compression
+
+    if method is not None and method not in methods():
+        log.error("compress: unsupported compression method %r", method)
+        raise SystemExit(1)
+
+    if method is None:
+        differs = models.File.compression.is_not(None)
+    else:
+        differs = or_(
+            models.File.compression.is_(None),
+            models.File.compression != method,
+        )
+
+    last = 0
+    converted = 0
+
+    while True:
+        with manager.DatabaseManager.get_session() as session:
+            files = (
+                session.query(models.File)
+                .filter(models.File.id > last, differs)
+                .order_by(models.File.id)
+                .options(undefer_group("raw"), undefer_group("fmt"))
+                .limit(batch_size)
+                .all()
             )
 
-            formatted = pygments.highlight(file.raw, lexer, formatter)
+            if not files:
+                break
 
-            file.fmt = formatted
+            for file in files:
+                raw, fmt = file.raw, file.fmt
 
-        session.commit()
+                file.compression = method
+                file.raw = raw
+                file.fmt = fmt
 
-        log.info("resyntax: highlighted %d pastes", len(files))
+            session.commit()
+
+        last = files[-1].id
+        converted += len(files)
+
+        log.info("compress: converted %d files", converted)
+
+    log.info("compress: done, converted %d files to %s", converted, method)
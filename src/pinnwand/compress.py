@@ -0,0 +1,104 @@
+"""Compression of the text of files as it is stored in the database and of
+responses. Text can be stored as is, or compressed with zlib or, when the
+`zstandard` package is installed, with zstd. Responses are compressed with
+gzip or zstd."""
+
+import gzip
+import zlib
+from typing import Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# The `Content-Encoding` that text compressed with a method can be sent in as
+# is, zlib data is what HTTP calls `deflate`.
+CONTENT_ENCODINGS = {
+    "zlib": "deflate",
+    "zstd": "zstd",
+}
+
+
+def methods() -> Tuple[str, ...]:
+    """Return the compression methods that can be used."""
+    if zstandard is None:
+        return ("zlib",)
+
+    return ("zlib", "zstd")
+
+
+def encode(text: str, method: str) -> bytes:
+    """Compress text with a method."""
+    data = text.encode("utf-8")
+
+    if method == "zlib":
+        return zlib.compress(data, 9)
+
+    if method == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=19).compress(data)
+
+    raise ValueError(f"Unsupported compression method {method!r}")
+
+
+def decode(data: bytes, method: str) -> str:
+    """Decompress text that was compressed with a method."""
+    if method == "zlib":
+        return zlib.decompress(data).decode("utf-8")
+
+    if method == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+
+    raise ValueError(f"Unsupported compression method {method!r}")
+
+
+def store(
+    text: Optional[str], method: Optional[str]
+) -> Tuple[Optional[str], Optional[bytes]]:
+    """Return the `(text, data)` pair to store for text, only one of them is
+    used depending on whether there is a compression `method`."""
+    if text is None or method is None:
+        return text, None
+
+    return None, encode(text, method)
+
+
+def load(
+    text: Optional[str], data: Optional[bytes], method: Optional[str]
+) -> Optional[str]:
+    """Return the text from a stored `(text, data)` pair."""
+    if data is None or method is None:
+        return text
+
+    return decode(data, method)
+
+
+def content_encoding(method: Optional[str]) -> Optional[str]:
+    """Return the `Content-Encoding` for data compressed with a method, if
+    there is one."""
+    if method is None:
+        return None
+
+    return CONTENT_ENCODINGS.get(method)
+
+
+def content_encodings() -> Tuple[str, ...]:
+    """Return the `Content-Encoding`s responses can be compressed with, in
+    order of preference."""
+    if zstandard is None:
+        return ("gzip",)
+
+    return ("zstd", "gzip")
+
+
+def content_encode(data: bytes, encoding: str, best: bool = True) -> bytes:
+    """Compress a response body with a `Content-Encoding`. Bodies that are
+    compressed once and then cached use the highest levels, bodies that are
+    compressed for every response pass `best` as false for a fast level."""
+    if encoding == "gzip":
+        return gzip.compress(data, 9 if best else 1, mtime=0)
+
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=19 if best else 3).compress(data)
+
+    raise ValueError(f"Unsupported content encoding {encoding!r}")
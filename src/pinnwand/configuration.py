@@ -17,6 +17,7 @@ class Configuration:
 
     def __init__(self):
         self._database_uri = "sqlite:///:memory:"
+        self._database_read_uri = None
         self._paste_size = 256 * 1024  # in bytes
         self._footer = 'View <a href="//github.com/supakeen/pinnwand" target="_BLANK">source code</a>, the <a href="/removal">removal</a> or <a href="/expiry">expiry</a> stories, or read the <a href="/about">about</a> page.'
         self._paste_help = "<p>Welcome to pinnwand, this site is a pastebin. It allows you to share code with others. If you write code in the text area below and press the paste button you will be given a link you can share with others so they can view your code as well.</p><p>People with the link can view your pasted code, only you can remove your paste and it expires automatically. Note that anyone could guess the URI to your paste so don't rely on it being private.</p>"
@@ -28,6 +29,8 @@ class Configuration:
         self._report_email = None
         self._expiries = {"1day": 86400, "1week": 604800}
         self._reaping_periodicity = 1_800_800
+        self._reaping_batch_size = 1000
+        self._reaping_batch_pause = 100
         self._ratelimit = {
             "read": {
                 "capacity": 100,
@@ -46,12 +49,25 @@ class Configuration:
             },
         }
         self._spamscore = 50
+        self._highlight_workers = os.cpu_count() or 1
+        self._database_workers = 4
+        self._cache_size = 64 * 1024 * 1024  # in bytes
+        self._cache_ttl = 300  # in seconds
+        self._cache_missing_ttl = 60  # in seconds
+        self._storage_compression = None
+        self._download_compression_level = 6
+        self._highlight_wall_time = 10.0  # in seconds
+        self._highlight_cpu_time = 5.0  # in seconds
 
     # Define getters for each configuration parameter
     @property
     def database_uri(self):
         return self._database_uri
 
+    @property
+    def database_read_uri(self) -> Optional[str]:
+        return self._database_read_uri
+
     @property
     def paste_size(self):
         return self._paste_size
@@ -96,6 +112,14 @@ class Configuration:
     def reaping_periodicity(self):
         return self._reaping_periodicity
 
+    @property
+    def reaping_batch_size(self) -> int:
+        return self._reaping_batch_size
+
+    @property
+    def reaping_batch_pause(self) -> int:
+        return self._reaping_batch_pause
+
     @property
     def ratelimit(self):
         return self._ratelimit
@@ -104,6 +128,42 @@ class Configuration:
     def spamscore(self):
         return self._spamscore
 
+    @property
+    def highlight_workers(self) -> int:
+        return self._highlight_workers
+
+    @property
+    def database_workers(self) -> int:
+        return self._database_workers
+
+    @property
+    def cache_size(self) -> int:
+        return self._cache_size
+
+    @property
+    def cache_ttl(self) -> int:
+        return self._cache_ttl
+
+    @property
+    def cache_missing_ttl(self) -> int:
+        return self._cache_missing_ttl
+
+    @property
+    def storage_compression(self) -> Optional[str]:
+        return self._storage_compression
+
+    @property
+    def highlight_wall_time(self) -> float:
+        return self._highlight_wall_time
+
+    @property
+    def highlight_cpu_time(self) -> float:
+        return self._highlight_cpu_time
+
+    @property
+    def download_compression_level(self) -> int:
+        return self._download_compression_level
+
     def load_config_file(self, path: Optional[str] = None) -> None:
         """Load configuration settings from a toml file."""
 
@@ -1,36 +1,96 @@
+import asyncio
 import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
 
 from sqlalchemy import create_engine, Engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session
+from sqlalchemy.pool import StaticPool
 
 
 from pinnwand.configuration import Configuration, ConfigurationProvider
 
+T = TypeVar("T")
+
 
 class DatabaseManager:
     """An entity responsible for managing database-related resources."""
 
-    _engine: Engine = None
+    _engine: Optional[Engine] = None
     _session_maker = None
+    _read_engine: Optional[Engine] = None
+    _read_session_maker = None
+    _executor: Optional[ThreadPoolExecutor] = None
+
+    @classmethod
+    def is_memory(cls) -> bool:
+        """Is the configured database an in-memory SQLite database?"""
+        configuration: Configuration = ConfigurationProvider.get_config()
+        url = make_url(configuration.database_uri)
+
+        return url.get_backend_name() == "sqlite" and url.database in (
+            None,
+            "",
+            ":memory:",
+        )
 
     @classmethod
-    def get_engine(cls):
+    def get_engine(cls) -> Engine:
         """Return an engine for the currently configured connection string."""
         configuration: Configuration = ConfigurationProvider.get_config()
         if not cls._engine:
-            cls._engine = create_engine(configuration.database_uri)
+            if cls.is_memory():
+                # An in-memory database only exists for the connection that
+                # created it, share that single connection between the
+                # threads that run queries.
+                cls._engine = create_engine(
+                    configuration.database_uri,
+                    poolclass=StaticPool,
+                    connect_args={"check_same_thread": False},
+                )
+            else:
+                cls._engine = create_engine(configuration.database_uri)
 
         return cls._engine
 
+    @classmethod
+    def get_read_engine(cls) -> Engine:
+        """Return an engine for the connection string that reads are done
+        on. This is the same engine as `get_engine` unless a separate
+        `database_read_uri` is configured."""
+        configuration: Configuration = ConfigurationProvider.get_config()
+
+        if not configuration.database_read_uri:
+            return cls.get_engine()
+
+        if not cls._read_engine:
+            cls._read_engine = create_engine(configuration.database_read_uri)
+
+        return cls._read_engine
+
     @classmethod
     @contextlib.contextmanager
-    def get_session(cls) -> Session:
-        """Create a self-disposable database session."""
+    def get_session(cls, read: bool = False) -> Session:
+        """Create a self-disposable database session. Sessions that only read
+        can pass `read` to be bound to the read engine."""
         if not cls._session_maker:
-            cls._session_maker = sessionmaker(bind=cls.get_engine())
+            # Objects are handed from the database threads to the handlers
+            # after their session has been committed and closed, keep their
+            # attributes around for that.
+            cls._session_maker = sessionmaker(
+                bind=cls.get_engine(), expire_on_commit=False
+            )
+
+        if not cls._read_session_maker:
+            cls._read_session_maker = sessionmaker(
+                bind=cls.get_read_engine(), expire_on_commit=False
+            )
 
-        new_session = cls._session_maker()
+        new_session = (
+            cls._read_session_maker() if read else cls._session_maker()
+        )
         try:
             yield new_session
         except Exception:
@@ -38,3 +98,49 @@ class DatabaseManager:
             raise
         finally:
             new_session.close()
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        """Return the pool of threads that database work is done on."""
+        configuration: Configuration = ConfigurationProvider.get_config()
+
+        if not cls._executor:
+            cls._executor = ThreadPoolExecutor(
+                # There is only a single connection to share for in-memory
+                # databases.
+                max_workers=(
+                    1 if cls.is_memory() else configuration.database_workers
+                ),
+                thread_name_prefix="pinnwand-database",
+            )
+
+        return cls._executor
+
+    @classmethod
+    def dispose(cls) -> None:
+        """Throw away the engine with its connections and the database
+        threads, they are created again on next use. Processes must not share
+        connections so this is done before forking."""
+        if cls._executor:
+            cls._executor.shutdown()
+            cls._executor = None
+
+        if cls._engine:
+            cls._engine.dispose()
+            cls._engine = None
+
+        if cls._read_engine:
+            cls._read_engine.dispose()
+            cls._read_engine = None
+
+        cls._session_maker = None
+        cls._read_session_maker = None
+
+    @classmethod
+    async def run(cls, fn: Callable[..., T], *args: Any) -> T:
+        """Run a blocking function that talks to the database on one of the
+        database threads so the IOLoop is free to serve other requests in the
+        meantime."""
+        return await asyncio.get_running_loop().run_in_executor(
+            cls.get_executor(), fn, *args
+        )
@@ -2,24 +2,24 @@ import datetime
 from datetime import timedelta, timezone
 from typing import Optional
 
-import pygments.lexers
-from pygments_better_html import BetterHtmlFormatter
 from sqlalchemy import (
     Column,
     ForeignKey,
     Integer,
+    LargeBinary,
     String,
     Text,
 )
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import (
     declarative_base,
+    deferred,
     relationship,
 )
 
 from sqlalchemy_utc import UtcDateTime
 
-from pinnwand import defensive, error, logger, utility
+from pinnwand import compress, defensive, error, highlight, logger, utility
 from pinnwand.configuration import Configuration, ConfigurationProvider
 
 log = logger.get_logger(__name__)
@@ -50,7 +50,7 @@ class Paste(Base):  # type: ignore
 
     src = Column(String(250))
 
-    exp_date = Column(UtcDateTime)
+    exp_date = Column(UtcDateTime, index=True)
 
     files = relationship("File", cascade="all,delete", backref="paste")
 
@@ -64,7 +64,7 @@ class Paste(Base):  # type: ignore
         # Unless someone proves me wrong that I need to check for collisions
         # my famous last words will be that the odds are astronomically small
         self.slug = slug
-        self.removal = utility.slug_create(auto_scale=False)
+        self.removal = utility.hash_create(16)
 
         self.pub_date = datetime.datetime.now(timezone.utc)
         self.chg_date = datetime.datetime.now(timezone.utc)
@@ -79,7 +79,7 @@ class Paste(Base):  # type: ignore
 
 
 class File(Base):  # type: ignore
-    paste_id = Column(ForeignKey("paste.id"))
+    paste_id = Column(ForeignKey("paste.id", ondelete="CASCADE"), index=True)
     slug = Column(String(255), unique=True)
 
     pub_date = Column(UtcDateTime)
@@ -87,8 +87,21 @@ class File(Base):  # type: ignore
 
     lexer = Column(String(250))
 
-    raw = Column(Text)
-    fmt = Column(Text)
+    # The text of files is only loaded when asked for, the highlighted text in
+    # particular is a lot larger than the raw text and only needed to show a
+    # paste. Text is stored as is in the `_text` columns, or compressed with
+    # the method in `compression` in the `_data` columns. Use `raw` and `fmt`
+    # to get at the text and the `raw` and `fmt` groups to load it.
+    raw_text = deferred(Column("raw", Text), group="raw")
+    raw_data = deferred(Column(LargeBinary), group="raw")
+    fmt_text = deferred(Column("fmt", Text), group="fmt")
+    fmt_data = deferred(Column(LargeBinary), group="fmt")
+
+    # Where each line of the raw text starts, so ranges of lines can be taken
+    # from it without splitting the whole text, see `utility.line_index`
+    line_index = deferred(Column(LargeBinary), group="raw")
+
+    compression = Column(String(16))
 
     filename = Column(String(250))
 
@@ -98,6 +111,7 @@ class File(Base):  # type: ignore
         raw: str,
         lexer: str = "text",
         filename: Optional[str] = None,
+        fmt: Optional[str] = None,
     ) -> None:
         # Start with some basic housekeeping related to size
         if not len(raw):
@@ -113,25 +127,28 @@ class File(Base):  # type: ignore
         self.pub_date = datetime.datetime.now(timezone.utc)
         self.chg_date = datetime.datetime.now(timezone.utc)
 
+        self.compression = configuration.storage_compression
+
         self.raw = raw
 
-        if defensive.spamscore(raw) > configuration.spamscore:
-            raise error.SpamError("Text exceeds spam score.")
+        defensive.reject_spam(raw)
 
         self.filename = filename
 
         self.lexer = lexer
 
-        if lexer == "autodetect":
-            lexer = utility.guess_language(raw, filename)
-            log.debug(f"Language guessed as {lexer}")
-
-        lexer = pygments.lexers.get_lexer_by_name(lexer)
-        formatter = BetterHtmlFormatter(  # pylint: disable=no-member
-            linenos="table", cssclass="source"
-        )
-
-        formatted = pygments.highlight(self.raw, lexer, formatter)
+        # Highlighting is normally done up front in a worker process by the
+        # caller, if it wasn't we do it here
+        if fmt is None:
+            formatted = highlight.render(
+                raw,
+                lexer,
+                filename,
+                wall_time=configuration.highlight_wall_time,
+                cpu_time=configuration.highlight_cpu_time,
+            )
+        else:
+            formatted = fmt
 
         if len(formatted) >= configuration.paste_size:
             raise error.ValidationError(
@@ -141,6 +158,33 @@ class File(Base):  # type: ignore
         self.fmt = formatted
         self.slug = slug
 
+    @property
+    def raw(self) -> str:
+        return compress.load(self.raw_text, self.raw_data, self.compression)
+
+    @raw.setter
+    def raw(self, raw: str) -> None:
+        self.raw_text, self.raw_data = compress.store(raw, self.compression)
+        self.line_index = utility.line_index(raw)
+
+    def lines(self, first: int, last: Optional[int] = None) -> str:
+        """Return lines `first` up to and including `last` of the raw text,
+        counting from one."""
+        raw = self.raw
+
+        # Files from before lines were indexed
+        index = self.line_index or utility.line_index(raw)
+
+        return utility.line_slice(raw, index, first, last)
+
+    @property
+    def fmt(self) -> str:
+        return compress.load(self.fmt_text, self.fmt_data, self.compression)
+
+    @fmt.setter
+    def fmt(self, fmt: str) -> None:
+        self.fmt_text, self.fmt_data = compress.store(fmt, self.compression)
+
     @property
     def pretty_size(self) -> str:
         return utility.size_postfix(len(self.raw))
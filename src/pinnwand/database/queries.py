@@ -0,0 +1,150 @@
+"""Database work done on behalf of the request handlers. These functions are
+blocking and meant to be ran on the database threads through
+`DatabaseManager.run`; the objects they return are detached from their
+session and have everything the handlers need loaded."""
+
+from datetime import datetime, timezone
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy.orm import contains_eager, selectinload, undefer_group
+
+from pinnwand import logger, utility
+from pinnwand.database import manager, models
+
+log = logger.get_logger(__name__)
+
+
+def paste_create(
+    expiry: int,
+    src: str,
+    files: List[Tuple[str, str, Optional[str], str]],
+    auto_scale: bool = True,
+) -> models.Paste:
+    """Create and store a new paste with a file for each of the
+    `(raw, lexer, filename, fmt)` tuples in `files`."""
+
+    with manager.DatabaseManager.get_session() as session, utility.SlugContext(
+        auto_scale, session
+    ) as slug_context:
+        # One slug for the paste and one for every file
+        slug_context.reserve(len(files) + 1)
+
+        paste = models.Paste(next(slug_context), expiry, src)
+
+        for raw, lexer, filename, fmt in files:
+            paste.files.append(
+                models.File(next(slug_context), raw, lexer, filename, fmt)
+            )
+
+        # For the first file we will always use the same slug as the paste,
+        # since slugs are generated to be unique over both pastes and files
+        # this can be done safely.
+        paste.files[0].slug = paste.slug
+
+        session.add(paste)
+
+        try:
+            session.commit()
+        except Exception:  # XXX be more precise
+            log.warning("%r", slug_context._slugs)
+            raise
+
+        utility.ObjectCount.add(len(paste.files) + 1)
+
+        return paste
+
+
+def _files_options(raw: bool, fmt: bool) -> List[Any]:
+    """Loader options to load the files of a paste along with it, including
+    the deferred text columns asked for."""
+    files = selectinload(models.Paste.files)
+    options: List[Any] = [files]
+
+    if raw:
+        options.append(files.undefer_group("raw"))
+
+    if fmt:
+        options.append(files.undefer_group("fmt"))
+
+    return options
+
+
+def _link_files(paste: Optional[models.Paste]) -> Optional[models.Paste]:
+    """Load the paste of each file of a paste, this is served from the
+    identity map of the session so no queries are made. Afterwards the files
+    know their paste once detached."""
+    if paste is not None:
+        for file in paste.files:
+            file.paste
+
+    return paste
+
+
+def paste_by_slug(
+    slug: str, raw: bool = True, fmt: bool = True, read: bool = True
+) -> Optional[models.Paste]:
+    """Fetch a paste that hasn't expired and its files by slug. Only the text
+    columns of the files that are asked for with `raw` and `fmt` are
+    loaded. Without `read` the paste is fetched from the primary database
+    instead of the read engine."""
+
+    with manager.DatabaseManager.get_session(read=read) as session:
+        paste = (
+            session.query(models.Paste)
+            .filter(
+                models.Paste.slug == slug,
+                models.Paste.exp_date > datetime.now(timezone.utc),
+            )
+            .options(*_files_options(raw, fmt))
+            .first()
+        )
+
+        return _link_files(paste)
+
+
+def file_by_slug(
+    slug: str, raw: bool = True, read: bool = True
+) -> Optional[models.File]:
+    """Fetch a file and its paste by slug, in a single query. The raw text of
+    the file is only loaded if `raw` is asked for. Files of expired pastes
+    aren't returned. Without `read` the file is fetched from the primary
+    database instead of the read engine."""
+
+    options: List[Any] = [contains_eager(models.File.paste)]
+
+    if raw:
+        options.append(undefer_group("raw"))
+
+    with manager.DatabaseManager.get_session(read=read) as session:
+        return (
+            session.query(models.File)
+            .join(models.File.paste)
+            .filter(
+                models.File.slug == slug,
+                models.Paste.exp_date > datetime.now(timezone.utc),
+            )
+            .options(*options)
+            .first()
+        )
+
+
+def paste_remove(removal: str) -> Optional[models.Paste]:
+    """Remove the paste belonging to a removal id, the removed paste is
+    returned."""
+
+    with manager.DatabaseManager.get_session() as session:
+        paste = (
+            session.query(models.Paste)
+            .filter(models.Paste.removal == removal)
+            .first()
+        )
+
+        if not paste:
+            return None
+
+        session.delete(paste)
+        session.commit()
+
+        utility.ObjectCount.add(-(len(paste.files) + 1))
+
+        return paste
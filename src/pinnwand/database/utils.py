@@ -1,8 +1,66 @@
-from sqlalchemy import Engine
+from sqlalchemy import Engine, inspect, text
+
+from pinnwand import logger
 from .models import Base
 
+log = logger.get_logger(__name__)
+
 
 def create_tables(engine: Engine):
     """Creates all the defined database tables."""
 
     Base.metadata.create_all(engine)
+    create_columns(engine)
+    create_indexes(engine)
+
+
+def create_columns(engine: Engine) -> None:
+    """Adds the defined columns that are missing from existing tables. Only
+    nullable columns without a server default can be added this way, which is
+    how new columns are defined."""
+
+    inspector = inspect(engine)
+
+    for table in Base.metadata.sorted_tables:
+        existing = {
+            column["name"] for column in inspector.get_columns(table.name)
+        }
+
+        for column in table.columns:
+            if column.name in existing:
+                continue
+
+            log.info(
+                "create_columns: adding column %s.%s", table.name, column.name
+            )
+
+            preparer = engine.dialect.identifier_preparer
+
+            with engine.begin() as connection:
+                connection.execute(
+                    text(
+                        f"ALTER TABLE {preparer.format_table(table)} "
+                        f"ADD COLUMN {preparer.format_column(column)} "
+                        f"{column.type.compile(dialect=engine.dialect)}"
+                    )
+                )
+
+
+def create_indexes(engine: Engine) -> None:
+    """Creates the defined indexes that are missing from existing tables.
+    `create_all` only creates indexes along with new tables so databases from
+    before an index was added would otherwise never get it."""
+
+    inspector = inspect(engine)
+
+    for table in Base.metadata.sorted_tables:
+        existing = {
+            index["name"] for index in inspector.get_indexes(table.name)
+        }
+
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+
+            log.info("create_indexes: creating index %s", index.name)
+            index.create(engine)
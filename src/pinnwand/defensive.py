@@ -78,3 +78,14 @@ def spamscore(text: str) -> int:
     log.debug("spamscore: rated at %r score", score)
 
     return score
+
+
+def reject_spam(text: str) -> None:
+    """Raise a `SpamError` for text that scores over the configured
+    `spamscore`. Handlers check this before text is highlighted so spam
+    doesn't get the expensive treatment only to be refused."""
+
+    configuration: Configuration = ConfigurationProvider.get_config()
+
+    if spamscore(text) > configuration.spamscore:
+        raise error.SpamError("Text exceeds spam score.")
@@ -4,8 +4,8 @@ from urllib.parse import urljoin
 import tornado.web
 
 from pinnwand.configuration import Configuration, ConfigurationProvider
-from pinnwand.database import models, manager
-from pinnwand import defensive, error, logger, utility
+from pinnwand.database import manager, queries
+from pinnwand import cache, defensive, error, highlight, logger, utility
 
 log = logger.get_logger(__name__)
 
@@ -30,7 +30,7 @@ class Create(tornado.web.RequestHandler):
             super().write_error(status_code, **kwargs)
 
     @defensive.ratelimit(area="create")
-    def post(self) -> None:
+    async def post(self) -> None:
         configuration: Configuration = ConfigurationProvider.get_config()
         lexer = self.get_body_argument("lexer", "text")
         raw = self.get_body_argument("raw", "", strip=False)
@@ -53,27 +53,28 @@ class Create(tornado.web.RequestHandler):
             log.info("CurlCreate.post: a paste was submitted without raw")
             raise error.ValidationError("Invalid `expiry` supplied.\n")
 
-        paste = models.Paste(
-            utility.slug_create(), configuration.expiries[expiry], "curl"
+        defensive.reject_spam(raw)
+
+        fmt = await highlight.HighlightManager.render(raw, lexer)
+
+        paste = await manager.DatabaseManager.run(
+            queries.paste_create,
+            configuration.expiries[expiry],
+            "curl",
+            [(raw, lexer, None, fmt)],
         )
-        file = models.File(paste.slug, raw, lexer)
-        paste.files.append(file)
 
-        with manager.DatabaseManager.get_session() as session:
-            session.add(paste)
-            session.commit()
+        cache.created(paste)
 
-            # The removal cookie is set for the specific path of the paste it is
-            # related to
-            self.set_cookie(
-                "removal", str(paste.removal), path=f"/{paste.slug}"
-            )
+        # The removal cookie is set for the specific path of the paste it is
+        # related to
+        self.set_cookie("removal", str(paste.removal), path=f"/{paste.slug}")
 
-            url_request = self.request.full_url()
-            url_paste = urljoin(url_request, f"/{paste.slug}")
-            url_removal = urljoin(url_request, f"/remove/{paste.removal}")
-            url_raw = urljoin(url_request, f"/raw/{file.slug}")
+        url_request = self.request.full_url()
+        url_paste = urljoin(url_request, f"/{paste.slug}")
+        url_removal = urljoin(url_request, f"/remove/{paste.removal}")
+        url_raw = urljoin(url_request, f"/raw/{paste.files[0].slug}")
 
-            self.write(
-                f"Paste URL:   {url_paste}\nRaw URL:     {url_raw}\nRemoval URL: {url_removal}\n"
-            )
+        self.write(
+            f"Paste URL:   {url_paste}\nRaw URL:     {url_raw}\nRemoval URL: {url_removal}\n"
+        )
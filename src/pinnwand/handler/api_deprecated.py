@@ -1,5 +1,5 @@
 import json
-from datetime import datetime, timedelta, timezone
+from datetime import timedelta
 from typing import Any
 from urllib.parse import urljoin
 
@@ -7,9 +7,9 @@ import tornado.escape
 import tornado.web
 from tornado.escape import url_escape
 
-from pinnwand import defensive, error, logger, utility
+from pinnwand import cache, defensive, error, highlight, logger, utility
 from pinnwand.configuration import Configuration, ConfigurationProvider
-from pinnwand.database import models, manager
+from pinnwand.database import manager, queries
 
 log = logger.get_logger(__name__)
 
@@ -77,36 +77,21 @@ class Show(Base):
 
     @defensive.ratelimit(area="read")
     async def get(self, slug: str) -> None:  # type: ignore
-        with manager.DatabaseManager.get_session() as session:
-            paste = (
-                session.query(models.Paste)
-                .filter(models.Paste.slug == slug)
-                .first()
-            )
-
-            if not paste:
-                raise tornado.web.HTTPError(404)
+        paste = await manager.DatabaseManager.run(queries.paste_by_slug, slug)
 
-            if paste.exp_date < datetime.now(timezone.utc):
-                session.delete(paste)
-                session.commit()
-
-                log.warning(
-                    "Show.get: paste was expired, is your cronjob running?"
-                )
+        if not paste:
+            raise tornado.web.HTTPError(404)
 
-                raise tornado.web.HTTPError(404)
-
-            self.write(
-                {
-                    "paste_id": paste.slug,
-                    "raw": paste.files[0].raw,
-                    "fmt": paste.files[0].fmt,
-                    "lexer": paste.files[0].lexer,
-                    "expiry": paste.exp_date.isoformat(),
-                    "filename": paste.files[0].filename,
-                }
-            )
+        self.write(
+            {
+                "paste_id": paste.slug,
+                "raw": paste.files[0].raw,
+                "fmt": paste.files[0].fmt,
+                "lexer": paste.files[0].lexer,
+                "expiry": paste.exp_date.isoformat(),
+                "filename": paste.files[0].filename,
+            }
+        )
 
 
 class Create(Base):
@@ -142,29 +127,31 @@ class Create(Base):
             )
             raise tornado.web.HTTPError(400)
 
-        paste = models.Paste(
-            utility.slug_create(),
+        defensive.reject_spam(raw)
+
+        fmt = await highlight.HighlightManager.render(raw, lexer, filename)
+
+        paste = await manager.DatabaseManager.run(
+            queries.paste_create,
             configuration.expiries[expiry],
             "deprecated-api",
+            [(raw, lexer, filename, fmt)],
+        )
+
+        cache.created(paste)
+
+        req_url = self.request.full_url()
+        location = paste.slug
+        if filename:
+            location += "#" + url_escape(filename)
+        self.write(
+            {
+                "paste_id": paste.slug,
+                "removal_id": paste.removal,
+                "paste_url": urljoin(req_url, f"/{location}"),
+                "raw_url": urljoin(req_url, f"/raw/{paste.files[0].slug}"),
+            }
         )
-        paste.files.append(models.File(paste.slug, raw, lexer, filename))
-
-        with manager.DatabaseManager.get_session() as session:
-            session.add(paste)
-            session.commit()
-
-            req_url = self.request.full_url()
-            location = paste.slug
-            if filename:
-                location += "#" + url_escape(filename)
-            self.write(
-                {
-                    "paste_id": paste.slug,
-                    "removal_id": paste.removal,
-                    "paste_url": urljoin(req_url, f"/{location}"),
-                    "raw_url": urljoin(req_url, f"/raw/{paste.files[0].slug}"),
-                }
-            )
 
 
 class Remove(Base):
@@ -176,30 +163,22 @@ class Remove(Base):
 
     @defensive.ratelimit(area="delete")
     async def post(self) -> None:
-        with manager.DatabaseManager.get_session() as session:
-            paste = (
-                session.query(models.Paste)
-                .filter(
-                    models.Paste.removal == self.get_body_argument("removal_id")
-                )
-                .first()
-            )
+        paste = await manager.DatabaseManager.run(
+            queries.paste_remove, self.get_body_argument("removal_id")
+        )
 
-            if not paste:
-                self.set_status(400)
-                return
-
-            session.delete(paste)
-            session.commit()
-
-            # this is set this way because tornado tries to protect us
-            # by not allowing lists to be returned, looking at this code
-            # it really shouldn't be a list but we have to keep it for
-            # backwards compatibility
-            self.set_header("Content-Type", "application/json")
-            self.write(
-                json.dumps([{"paste_id": paste.slug, "status": "removed"}])
-            )
+        if not paste:
+            self.set_status(400)
+            return
+
+        cache.invalidate(paste.slug)
+
+        # this is set this way because tornado tries to protect us
+        # by not allowing lists to be returned, looking at this code
+        # it really shouldn't be a list but we have to keep it for
+        # backwards compatibility
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps([{"paste_id": paste.slug, "status": "removed"}]))
 
 
 class Lexer(Base):
@@ -207,7 +186,7 @@ class Lexer(Base):
 
     @defensive.ratelimit(area="read")
     async def get(self) -> None:
-        self.write(utility.list_languages())
+        utility.write_languages_json(self)
 
 
 class Expiry(Base):
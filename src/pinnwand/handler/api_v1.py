@@ -1,13 +1,13 @@
 import json
-from datetime import datetime, timedelta, timezone
-from typing import Any
+from datetime import timedelta
+from typing import Any, Optional, Tuple
 from urllib.parse import urljoin
 
 import tornado.web
 
-from pinnwand import defensive, error, logger, utility
+from pinnwand import cache, defensive, error, highlight, logger, utility
 from pinnwand.configuration import Configuration, ConfigurationProvider
-from pinnwand.database import models, manager
+from pinnwand.database import manager, queries
 
 log = logger.get_logger(__name__)
 
@@ -21,7 +21,7 @@ class Base(tornado.web.RequestHandler):
 class Lexer(Base):
     @defensive.ratelimit(area="read")
     async def get(self) -> None:
-        self.write(utility.list_languages())
+        utility.write_languages_json(self)
 
 
 class Expiry(Base):
@@ -66,95 +66,113 @@ class Paste(Base):
         if not files:
             raise tornado.web.HTTPError(400, "no files provided")
 
-        with manager.DatabaseManager.get_session() as session, utility.SlugContext(
-            auto_scale
-        ) as slug_context:
-            paste = models.Paste(
-                next(slug_context),
-                configuration.expiries[expiry],
-                "v1-api",
-            )
+        sources = []
 
-            for file in files:
-                lexer = file.get("lexer", "")
-                content = file.get("content")
-                filename = file.get("name")
+        for file in files:
+            lexer = file.get("lexer", "")
+            content = file.get("content")
+            filename = file.get("name")
 
-                if lexer not in utility.list_languages():
-                    raise tornado.web.HTTPError(400, "invalid lexer")
+            if lexer not in utility.list_languages():
+                raise tornado.web.HTTPError(400, "invalid lexer")
 
-                if not content:
-                    raise tornado.web.HTTPError(400, "invalid content (empty)")
+            if not content:
+                raise tornado.web.HTTPError(400, "invalid content (empty)")
 
-                try:
-                    paste.files.append(
-                        models.File(
-                            next(slug_context),
-                            content,
-                            lexer,
-                            filename,
-                        )
-                    )
-                except error.ValidationError:
-                    raise tornado.web.HTTPError(
-                        400, "invalid content (exceeds size limit)"
-                    )
+            sources.append((content, lexer, filename))
 
-            if sum(len(f.fmt) for f in paste.files) > configuration.paste_size:
-                raise tornado.web.HTTPError(
-                    400, "invalid content (exceeds size limit)"
-                )
+        for content, _, _ in sources:
+            defensive.reject_spam(content)
 
-            paste.files[0].slug = paste.slug
+        try:
+            # Highlight all files concurrently, each in their own job
+            fmts = await highlight.HighlightManager.render_many(sources)
+        except error.ValidationError:
+            raise tornado.web.HTTPError(
+                400, "invalid content (exceeds size limit)"
+            )
 
-            session.add(paste)
+        if sum(len(fmt) for fmt in fmts) > configuration.paste_size:
+            raise tornado.web.HTTPError(
+                400, "invalid content (exceeds size limit)"
+            )
 
-            try:
-                session.commit()
-            except Exception:  # XXX be more precise
-                log.warning("%r", slug_context._slugs)
-                raise
+        try:
+            paste = await manager.DatabaseManager.run(
+                queries.paste_create,
+                configuration.expiries[expiry],
+                "v1-api",
+                [
+                    (content, lexer, filename, fmt)
+                    for (content, lexer, filename), fmt in zip(sources, fmts)
+                ],
+                auto_scale,
+            )
+        except error.ValidationError:
+            raise tornado.web.HTTPError(
+                400, "invalid content (exceeds size limit)"
+            )
+
+        cache.created(paste)
 
-            # Send the client to the paste
-            url_request = self.request.full_url()
-            url_paste = urljoin(url_request, f"/{paste.slug}")
-            url_removal = urljoin(url_request, f"/remove/{paste.removal}")
+        # Send the client to the paste
+        url_request = self.request.full_url()
+        url_paste = urljoin(url_request, f"/{paste.slug}")
+        url_removal = urljoin(url_request, f"/remove/{paste.removal}")
 
-            self.write({"link": url_paste, "removal": url_removal})
+        self.write({"link": url_paste, "removal": url_removal})
 
 
 class PasteDetail(Base):
     @defensive.ratelimit(area="read")
     async def get(self, slug: str) -> None:
-        with manager.DatabaseManager.get_session() as session:
-            paste = (
-                session.query(models.Paste)
-                .filter(models.Paste.slug == slug)
-                .first()
-            )
+        variant = "json"
+
+        # Only return some of the lines of each file
+        value = self.get_query_argument("lines", None)
+        lines: Optional[Tuple[int, Optional[int]]] = None
+
+        if value is not None:
+            try:
+                lines = utility.parse_lines(value)
+            except ValueError:
+                raise tornado.web.HTTPError(400, "invalid lines")
+
+            first, last = lines
+            variant = f"json:lines={first}-{'' if last is None else last}"
+
+        if utility.is_conditional(self.request):
+            paste = await cache.paste_meta_by_slug(slug)
 
             if not paste:
                 raise tornado.web.HTTPError(404)
 
-            if paste.exp_date < datetime.now(timezone.utc):
-                session.delete(paste)
-                session.commit()
+            if utility.set_cache_headers(
+                self, paste.slug, paste.pub_date, paste.exp_date, variant
+            ):
+                self.set_status(304)
+                return
 
-                log.warning(
-                    "Show.get: paste was expired, is your cronjob running?"
-                )
+        paste = await cache.paste_by_slug(slug, fmt=False)
 
-                raise tornado.web.HTTPError(404)
+        if not paste:
+            raise tornado.web.HTTPError(404)
 
-            self.write(
-                {
-                    "files": [
-                        {
-                            "name": file.filename,
-                            "lexer": file.lexer,
-                            "content": file.raw,
-                        }
-                        for file in paste.files
-                    ],
-                }
-            )
+        utility.set_cache_headers(
+            self, paste.slug, paste.pub_date, paste.exp_date, variant
+        )
+
+        self.write(
+            {
+                "files": [
+                    {
+                        "name": file.filename,
+                        "lexer": file.lexer,
+                        "content": (
+                            file.raw if lines is None else file.lines(*lines)
+                        ),
+                    }
+                    for file in paste.files
+                ],
+            }
+        )
@@ -1,21 +1,24 @@
-import binascii
-import io
+import asyncio
+import functools
 import zipfile
 from datetime import datetime, timezone
-from typing import Any
+from typing import Any, List, Optional, Tuple
 
 import docutils.core
 import tornado.web
 
 from pinnwand import (
+    cache,
+    compress,
     defensive,
     error,
+    highlight,
     logger,
     path,
     utility,
 )
 from pinnwand.configuration import Configuration, ConfigurationProvider
-from pinnwand.database import manager, models
+from pinnwand.database import manager, models, queries
 
 log = logger.get_logger(__name__)
 
@@ -77,6 +80,178 @@ class Base(tornado.web.RequestHandler):
     async def post(self) -> None:
         raise tornado.web.HTTPError(405)
 
+    async def paste_not_modified(
+        self, slug: str, variant: str, weak: bool = False
+    ) -> bool:
+        """For conditional requests, look up a paste without its text and
+        answer with a 304 if the client's copy is current, `weak` is passed
+        on to `utility.set_cache_headers`. Returns whether the request was
+        answered."""
+
+        if not utility.is_conditional(self.request):
+            return False
+
+        paste = await cache.paste_meta_by_slug(slug)
+
+        if not paste:
+            raise tornado.web.HTTPError(404)
+
+        if not utility.set_cache_headers(
+            self, paste.slug, paste.pub_date, paste.exp_date, variant, weak
+        ):
+            return False
+
+        self.set_status(304)
+        return True
+
+    async def file_not_modified(
+        self, slug: str, variant: str, raw: bool = False
+    ) -> bool:
+        """For conditional requests, look up a file without its text and
+        answer with a 304 if the client's copy is current. Handlers that send
+        the raw text of the file pass `raw`. Returns whether the request was
+        answered."""
+
+        if not utility.is_conditional(self.request):
+            return False
+
+        file = await cache.file_meta_by_slug(slug)
+
+        if not file:
+            raise tornado.web.HTTPError(404)
+
+        if raw:
+            variant = f"{variant}:{self.negotiate_raw(file) or 'identity'}"
+
+        if not utility.set_cache_headers(
+            self, file.slug, file.pub_date, file.paste.exp_date, variant
+        ):
+            return False
+
+        self.set_status(304)
+        return True
+
+    def negotiate_raw(self, file: models.File) -> Optional[str]:
+        """Return the `Content-Encoding` to send the raw text of a file in, if
+        the client accepts any. The encoding the text is stored in is
+        preferred as it can be sent as is. Ranges are only served of the
+        text itself."""
+
+        self.set_header("Vary", "Accept-Encoding")
+
+        if "Range" in self.request.headers:
+            return None
+
+        stored = compress.content_encoding(file.compression)
+
+        return utility.negotiate_encoding(
+            self.request.headers.get("Accept-Encoding", ""),
+            ((stored,) if stored else ()) + compress.content_encodings(),
+        )
+
+    async def write_raw(self, file: models.File, variant: str) -> None:
+        """Write the raw text of a file, compressed if the client accepts
+        that. Text is sent as it's stored if possible, otherwise it's
+        compressed once and cached. A `Range` of the text is answered with a
+        206."""
+
+        encoding = self.negotiate_raw(file)
+        variant = f"{variant}:{encoding or 'identity'}"
+
+        utility.set_cache_headers(
+            self, file.slug, file.pub_date, file.paste.exp_date, variant
+        )
+
+        self.set_header("Accept-Ranges", "bytes")
+
+        header = self.request.headers.get("Range")
+
+        if header is not None and utility.if_range(
+            self.request, file.slug, file.pub_date, variant
+        ):
+            data = raw_bytes(file)
+            span = utility.parse_range(header, len(data))
+
+            if span is not None:
+                self.write_range(data, *span)
+                return
+
+        if encoding is None:
+            self.write(file.raw)
+            return
+
+        self.set_header("Content-Encoding", encoding)
+
+        if encoding == compress.content_encoding(file.compression):
+            self.write(file.raw_data)
+            return
+
+        name = f"raw:{file.slug}"
+        page = cache.PageCache.get(file.paste.slug, name, encoding)
+
+        if page is None:
+            page = await cache.flights.run(
+                (name, encoding), lambda: encode_raw(file, encoding)
+            )
+
+        self.write(page.body)
+
+    def write_range(self, data: bytes, start: int, end: int) -> None:
+        """Write the bytes from `start` up to `end` of data as a 206, or a
+        416 if there are none."""
+
+        if start >= end:
+            self.set_status(416)
+            self.set_header("Content-Range", f"bytes */{len(data)}")
+            return
+
+        self.set_status(206)
+        self.set_header("Content-Range", f"bytes {start}-{end - 1}/{len(data)}")
+        self.write(data[start:end])
+
+
+def raw_bytes(file: models.File) -> bytes:
+    """Return the raw text of a file encoded, cached so ranges of it are
+    sliced out of the same bytes instead of encoding the text again for
+    every request."""
+
+    name = f"raw:{file.slug}"
+    page = cache.PageCache.get(file.paste.slug, name, "identity")
+
+    if page is not None:
+        return page.body
+
+    body = file.raw.encode("utf-8")
+    cache.PageCache.put(file.paste, name, "identity", body)
+
+    return body
+
+
+async def encode(body: bytes, encoding: str) -> bytes:
+    """Compress a response body off the IOLoop. Bodies that won't be cached
+    are compressed for every response, those get a fast level."""
+    return await asyncio.get_running_loop().run_in_executor(
+        None,
+        compress.content_encode,
+        body,
+        encoding,
+        cache.PageCache.fits(len(body)),
+    )
+
+
+async def encode_raw(file: models.File, encoding: str) -> cache.Page:
+    """Compress the raw text of a file and cache it."""
+
+    generation = cache.PageCache.generation()
+
+    body = await encode(file.raw.encode("utf-8"), encoding)
+
+    cache.PageCache.put(
+        file.paste, f"raw:{file.slug}", encoding, body, generation
+    )
+
+    return cache.Page(body, file.pub_date, file.paste.exp_date)
+
 
 class Create(Base):
     """The index page shows the new paste page with a list of all available
@@ -140,26 +315,25 @@ class Create(Base):
             log.info("Paste.post: a paste was submitted with an invalid expiry")
             raise tornado.web.HTTPError(400)
 
-        paste = models.Paste(
-            utility.slug_create(),
+        defensive.reject_spam(raw)
+
+        fmt = await highlight.HighlightManager.render(raw, lexer)
+
+        paste = await manager.DatabaseManager.run(
+            queries.paste_create,
             configuration.expiries[expiry],
             "deprecated-web",
+            [(raw, lexer, None, fmt)],
         )
-        file = models.File(paste.slug, raw, lexer)
-        paste.files.append(file)
 
-        with manager.DatabaseManager.get_session() as session:
-            session.add(paste)
-            session.commit()
+        cache.created(paste)
 
-            # The removal cookie is set for the specific path of the paste it is
-            # related to
-            self.set_cookie(
-                "removal", str(paste.removal), path=f"/{paste.slug}"
-            )
+        # The removal cookie is set for the specific path of the paste it is
+        # related to
+        self.set_cookie("removal", str(paste.removal), path=f"/{paste.slug}")
 
-            # Send the client to the paste
-            self.redirect(f"/{paste.slug}")
+        # Send the client to the paste
+        self.redirect(f"/{paste.slug}")
 
     def check_xsrf_cookie(self) -> None:
         """The CSRF token check is disabled. While it would be better if it
@@ -175,7 +349,7 @@ class CreateAction(Base):
     file pastes."""
 
     @defensive.ratelimit(area="create")
-    def post(self) -> None:  # type: ignore
+    async def post(self) -> None:  # type: ignore
         """POST handler for the 'web' side of things."""
 
         configuration: Configuration = ConfigurationProvider.get_config()
@@ -213,47 +387,40 @@ class CreateAction(Base):
             log.info("CreateAction.post: a file had an invalid lexer")
             raise error.ValidationError("Invalid lexer provided")
 
-        with manager.DatabaseManager.get_session() as session, utility.SlugContext(
-            auto_scale
-        ) as slug_context:
-            paste = models.Paste(
-                next(slug_context), configuration.expiries[expiry], "web"
-            )
+        filenames = [filename if filename else None for filename in filenames]
 
-            for lexer, raw, filename in zip(lexers, raws, filenames):
-                paste.files.append(
-                    models.File(
-                        next(slug_context),
-                        raw,
-                        lexer,
-                        filename if filename else None,
-                    )
-                )
+        for raw in raws:
+            defensive.reject_spam(raw)
 
-            total_size = sum(len(f.fmt) for f in paste.files)
-            if total_size > configuration.paste_size:
-                log.info("CreateAction.post: sum of files was too large")
-                raise error.ValidationError(
-                    "Sum of file sizes exceeds size limit when syntax highlighting applied "
-                    f"({total_size//1024}kB > {configuration.paste_size//1024}kB)"
-                )
+        # Highlight all files concurrently, each in their own job
+        fmts = await highlight.HighlightManager.render_many(
+            list(zip(raws, lexers, filenames))
+        )
 
-            # For the first file we will always use the same slug as the paste,
-            # since slugs are generated to be unique over both pastes and files
-            # this can be done safely.
-            paste.files[0].slug = paste.slug
+        total_size = sum(len(fmt) for fmt in fmts)
+        if total_size > configuration.paste_size:
+            log.info("CreateAction.post: sum of files was too large")
+            raise error.ValidationError(
+                "Sum of file sizes exceeds size limit when syntax highlighting applied "
+                f"({total_size//1024}kB > {configuration.paste_size//1024}kB)"
+            )
+
+        paste = await manager.DatabaseManager.run(
+            queries.paste_create,
+            configuration.expiries[expiry],
+            "web",
+            list(zip(raws, lexers, filenames, fmts)),
+            auto_scale,
+        )
 
-            session.add(paste)
-            session.commit()
+        cache.created(paste)
 
-            # The removal cookie is set for the specific path of the paste it is
-            # related to
-            self.set_cookie(
-                "removal", str(paste.removal), path=f"/{paste.slug}"
-            )
+        # The removal cookie is set for the specific path of the paste it is
+        # related to
+        self.set_cookie("removal", str(paste.removal), path=f"/{paste.slug}")
 
-            # Send the client to the paste
-            self.redirect(f"/{paste.slug}")
+        # Send the client to the paste
+        self.redirect(f"/{paste.slug}")
 
 
 class Repaste(Base):
@@ -267,27 +434,25 @@ class Repaste(Base):
 
         configuration: Configuration = ConfigurationProvider.get_config()
 
-        with manager.DatabaseManager.get_session() as session:
-            paste = (
-                session.query(models.Paste)
-                .filter(models.Paste.slug == slug)
-                .first()
-            )
+        # Only the raw text is used to fill the form
+        paste = await manager.DatabaseManager.run(
+            queries.paste_by_slug, slug, True, False
+        )
 
-            if not paste:
-                raise tornado.web.HTTPError(404)
+        if not paste:
+            raise tornado.web.HTTPError(404)
 
-            lexers_available = utility.list_languages()
+        lexers_available = utility.list_languages()
 
-            await self.render(
-                "create.html",
-                expiries=configuration.expiries,
-                lexers=["text"],  # XXX make this majority of file lexers?
-                lexers_available=lexers_available,
-                pagetitle="repaste",
-                message=None,
-                paste=paste,
-            )
+        await self.render(
+            "create.html",
+            expiries=configuration.expiries,
+            lexers=["text"],  # XXX make this majority of file lexers?
+            lexers_available=lexers_available,
+            pagetitle="repaste",
+            message=None,
+            paste=paste,
+        )
 
 
 class Show(Base):
@@ -295,37 +460,76 @@ class Show(Base):
 
     @defensive.ratelimit(area="read")
     async def get(self, slug: str) -> None:  # type: ignore
-        """Fetch paste from database by slug and render the paste."""
+        """Fetch paste from database by slug and render the paste. Rendered
+        pages are cached, the link to remove the paste is shown by the
+        browser of whoever holds the removal cookie."""
+
+        encoding = (
+            utility.negotiate_encoding(
+                self.request.headers.get("Accept-Encoding", ""),
+                compress.content_encodings(),
+            )
+            or "identity"
+        )
+
+        self.set_header("Vary", "Accept-Encoding")
+
+        page = cache.PageCache.get(slug, "show", encoding)
 
-        with manager.DatabaseManager.get_session() as session:
-            paste = (
-                session.query(models.Paste)
-                .filter(models.Paste.slug == slug)
-                .first()
+        # The page is rendered from the highlighted text, which is redone by
+        # `resyntax` and upgrades, so its ETag is weak
+        if page is None and await self.paste_not_modified(
+            slug, encoding, weak=True
+        ):
+            return
+
+        if page is None:
+            # Concurrent requests for the same page share one render
+            page = await cache.flights.run(
+                ("page", slug, encoding),
+                lambda: self.render_page(slug, encoding),
             )
 
-            if not paste:
-                raise tornado.web.HTTPError(404)
+        if page is None:
+            raise tornado.web.HTTPError(404)
+
+        if utility.set_cache_headers(
+            self, slug, page.pub_date, page.exp_date, encoding, weak=True
+        ):
+            self.set_status(304)
+            return
 
-            if paste.exp_date < datetime.now(timezone.utc):
-                session.delete(paste)
-                session.commit()
+        if encoding != "identity":
+            self.set_header("Content-Encoding", encoding)
 
-                log.warning(
-                    "Show.get: paste was expired, is your cronjob running?"
-                )
+        self.write(page.body)
 
-                raise tornado.web.HTTPError(404)
+    async def render_page(
+        self, slug: str, encoding: str
+    ) -> Optional[cache.Page]:
+        """Render the page for a paste in an encoding and cache it, returns
+        `None` if there is no such paste."""
 
-            can_delete = self.get_cookie("removal") == str(paste.removal)
+        generation = cache.PageCache.generation()
 
-            self.render(
-                "show.html",
-                paste=paste,
-                pagetitle=f"View paste {paste.slug}",
-                can_delete=can_delete,
-                linenos=False,
-            )
+        paste = await cache.paste_by_slug(slug)
+
+        if not paste:
+            return None
+
+        body = self.render_string(
+            "show.html",
+            paste=paste,
+            pagetitle=f"View paste {paste.slug}",
+            linenos=False,
+        )
+
+        if encoding != "identity":
+            body = await encode(body, encoding)
+
+        cache.PageCache.put(paste, "show", encoding, body, generation)
+
+        return cache.Page(body, paste.pub_date, paste.exp_date)
 
 
 class RedirectShow(Base):
@@ -334,27 +538,15 @@ class RedirectShow(Base):
     async def get(self, slug: str) -> None:  # type: ignore
         """Fetch paste from database and redirect to /slug if the paste
         exists."""
-        with manager.DatabaseManager.get_session() as session:
-            paste = (
-                session.query(models.Paste)
-                .filter(models.Paste.slug == slug)
-                .first()
-            )
-
-            if not paste:
-                raise tornado.web.HTTPError(404)
-
-            if paste.exp_date < datetime.now(timezone.utc):
-                session.delete(paste)
-                session.commit()
 
-                log.warning(
-                    "RedirectShow.get: paste was expired, is your cronjob running?"
-                )
+        paste = await manager.DatabaseManager.run(
+            queries.paste_by_slug, slug, False, False
+        )
 
-                raise tornado.web.HTTPError(404)
+        if not paste:
+            raise tornado.web.HTTPError(404)
 
-            self.redirect(f"/{paste.slug}")
+        self.redirect(f"/{paste.slug}")
 
 
 class FileRaw(Base):
@@ -362,61 +554,105 @@ class FileRaw(Base):
 
     @defensive.ratelimit(area="read")
     async def get(self, file_id: str) -> None:  # type: ignore
-        """Get a file from the database and show it in the plain."""
+        """Get a file from the database and show it in the plain. Only some
+        of its lines are shown when a range of them is asked for with
+        `lines`."""
 
-        with manager.DatabaseManager.get_session() as session:
-            file = (
-                session.query(models.File)
-                .filter(models.File.slug == file_id)
-                .first()
-            )
+        value = self.get_query_argument("lines", None)
 
-            if not file:
-                raise tornado.web.HTTPError(404)
+        if value is not None:
+            await self.get_lines(file_id, value)
+            return
 
-            if file.paste.exp_date < datetime.now(timezone.utc):
-                session.delete(file.paste)
-                session.commit()
+        if await self.file_not_modified(file_id, "raw", raw=True):
+            return
 
-                log.warning(
-                    "FileRaw.get: paste was expired, is your cronjob running?"
-                )
+        file = await cache.file_by_slug(file_id)
 
-                raise tornado.web.HTTPError(404)
+        if not file:
+            raise tornado.web.HTTPError(404)
 
-            self.set_header("Content-Type", "text/plain; charset=utf-8")
-            self.write(file.raw)
+        self.set_header("Content-Type", "text/plain; charset=utf-8")
+        await self.write_raw(file, "raw")
+
+    async def get_lines(self, file_id: str, value: str) -> None:
+        """Show a range of lines of a file such as `100-200`."""
+
+        try:
+            first, last = utility.parse_lines(value)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+
+        variant = f"raw:lines={first}-{'' if last is None else last}"
+
+        if await self.file_not_modified(file_id, variant):
+            return
+
+        file = await cache.file_by_slug(file_id)
+
+        if not file:
+            raise tornado.web.HTTPError(404)
+
+        utility.set_cache_headers(
+            self, file.slug, file.pub_date, file.paste.exp_date, variant
+        )
+
+        self.set_header("Content-Type", "text/plain; charset=utf-8")
+        self.write(file.lines(first, last))
 
 
 class FileHex(Base):
     """Show a file as hexadecimal."""
 
+    # Bytes of the file that are formatted and sent at a time
+    chunk_size = 4096
+
+    def window(self) -> Tuple[int, Optional[int]]:
+        """Return the `offset` and `length` in bytes of the part of the file
+        that is asked for, without a `length` the rest of the file is."""
+
+        try:
+            offset = int(self.get_query_argument("offset", "0"))
+            length = self.get_query_argument("length", None)
+            length = int(length) if length is not None else None
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+
+        if offset < 0 or (length is not None and length < 0):
+            raise tornado.web.HTTPError(400)
+
+        return offset, length
+
     @defensive.ratelimit(area="read")
     async def get(self, file_id: str) -> None:  # type: ignore
-        """Get a file from the database and show it in hex."""
+        """Get a file from the database and show it as a hexdump, in chunks.
+        Large files can be paged through with `offset` and `length`."""
 
-        with manager.DatabaseManager.get_session() as session:
-            file = (
-                session.query(models.File)
-                .filter(models.File.slug == file_id)
-                .first()
-            )
+        offset, length = self.window()
+        variant = f"hex:{offset}:{'' if length is None else length}"
 
-            if not file:
-                raise tornado.web.HTTPError(404)
+        if await self.file_not_modified(file_id, variant):
+            return
 
-            if file.paste.exp_date < datetime.now(timezone.utc):
-                session.delete(file.paste)
-                session.commit()
+        file = await cache.file_by_slug(file_id)
 
-                log.warning(
-                    "FileRaw.get: paste was expired, is your cronjob running?"
-                )
+        if not file:
+            raise tornado.web.HTTPError(404)
+
+        utility.set_cache_headers(
+            self, file.slug, file.pub_date, file.paste.exp_date, variant
+        )
 
-                raise tornado.web.HTTPError(404)
+        self.set_header("Content-Type", "text/plain; charset=utf-8")
 
-            self.set_header("Content-Type", "text/plain; charset=utf-8")
-            self.write(binascii.hexlify(file.raw.encode("utf8")))
+        # The encoded text is cached, only the window is formatted
+        data = memoryview(raw_bytes(file))
+        end = len(data) if length is None else min(len(data), offset + length)
+
+        for start in range(offset, end, self.chunk_size):
+            chunk = data[start : min(end, start + self.chunk_size)]
+            self.write(utility.hexdump(chunk.tobytes(), start))
+            await self.flush()
 
 
 class PasteDownload(Base):
@@ -426,44 +662,79 @@ class PasteDownload(Base):
     async def get(self, paste_id: str) -> None:  # type: ignore
         """Get all files from the database and download them as a zipfile."""
 
-        with manager.DatabaseManager.get_session() as session:
-            paste = (
-                session.query(models.Paste)
-                .filter(models.Paste.slug == paste_id)
-                .first()
-            )
+        # The archive depends on `download_compression_level`, its ETag is weak
+        if await self.paste_not_modified(paste_id, "zip", weak=True):
+            return
+
+        paste = await cache.paste_by_slug(paste_id, fmt=False)
+
+        if not paste:
+            raise tornado.web.HTTPError(404)
 
-            if not paste:
-                raise tornado.web.HTTPError(404)
+        utility.set_cache_headers(
+            self, paste.slug, paste.pub_date, paste.exp_date, "zip", weak=True
+        )
 
-            if paste.exp_date < datetime.now(timezone.utc):
-                session.delete(paste)
-                session.commit()
+        self.set_header("Content-Type", "application/zip")
+        self.set_header(
+            "Content-Disposition", f"attachment; filename={paste.slug}.zip"
+        )
 
-                log.warning(
-                    "FileRaw.get: paste was expired, is your cronjob running?"
+        configuration: Configuration = ConfigurationProvider.get_config()
+        loop = asyncio.get_running_loop()
+
+        # Each file is compressed on a thread, its part of the archive is
+        # sent before the next file is started.
+        stream = ZipStream()
+
+        with zipfile.ZipFile(stream, "w") as zf:
+            for file in paste.files:
+                if file.filename:
+                    filename = f"{utility.filename_clean(file.filename)}-{file.slug}.txt"
+                else:
+                    filename = f"{file.slug}.txt"
+
+                # Entries are dated by their file so the archive is the same
+                # for every request
+                info = zipfile.ZipInfo(filename, file.pub_date.timetuple()[:6])
+                info.external_attr = 0o644 << 16
+
+                await loop.run_in_executor(
+                    None,
+                    functools.partial(
+                        zf.writestr,
+                        info,
+                        file.raw,
+                        compress_type=zipfile.ZIP_DEFLATED,
+                        compresslevel=configuration.download_compression_level,
+                    ),
                 )
 
-                raise tornado.web.HTTPError(404)
+                self.write(stream.take())
+                await self.flush()
 
-            data = io.BytesIO()
+        self.write(stream.take())
 
-            with zipfile.ZipFile(data, "x") as zf:
-                for file in paste.files:
-                    if file.filename:
-                        filename = f"{utility.filename_clean(file.filename)}-{file.slug}.txt"
-                    else:
-                        filename = f"{file.slug}.txt"
 
-                    zf.writestr(filename, file.raw)
+class ZipStream:
+    """A file-like object to write a zip archive to that can't seek. Written
+    data is kept until it's taken to be sent."""
 
-            data.seek(0)
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
 
-            self.set_header("Content-Type", "application/zip")
-            self.set_header(
-                "Content-Disposition", f"attachment; filename={paste.slug}.zip"
-            )
-            self.write(data.read())
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        """Return and forget the data written so far."""
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
 
 
 class FileDownload(Base):
@@ -473,39 +744,27 @@ class FileDownload(Base):
     async def get(self, file_id: str) -> None:  # type: ignore
         """Get a file from the database and download it in the plain."""
 
-        with manager.DatabaseManager.get_session() as session:
-            file = (
-                session.query(models.File)
-                .filter(models.File.slug == file_id)
-                .first()
-            )
-
-            if not file:
-                raise tornado.web.HTTPError(404)
-
-            if file.paste.exp_date < datetime.now(timezone.utc):
-                session.delete(file.paste)
-                session.commit()
-
-                log.warning(
-                    "FileDownload.get: paste was expired, is your cronjob running?"
-                )
+        if await self.file_not_modified(file_id, "download", raw=True):
+            return
 
-                raise tornado.web.HTTPError(404)
+        file = await cache.file_by_slug(file_id)
 
-            self.set_header("Content-Type", "text/plain; charset=utf-8")
+        if not file:
+            raise tornado.web.HTTPError(404)
 
-            if file.filename:
-                filename = (
-                    f"{utility.filename_clean(file.filename)}-{file.slug}.txt"
-                )
-            else:
-                filename = f"{file.slug}.txt"
+        self.set_header("Content-Type", "text/plain; charset=utf-8")
 
-            self.set_header(
-                "Content-Disposition", f"attachment; filename={filename}"
+        if file.filename:
+            filename = (
+                f"{utility.filename_clean(file.filename)}-{file.slug}.txt"
             )
-            self.write(file.raw)
+        else:
+            filename = f"{file.slug}.txt"
+
+        self.set_header(
+            "Content-Disposition", f"attachment; filename={filename}"
+        )
+        await self.write_raw(file, "download")
 
 
 class Remove(Base):
@@ -516,29 +775,20 @@ class Remove(Base):
         """Look up if the user visiting this page has the removal id for a
         certain paste. If they do they're authorized to remove the paste."""
 
-        with manager.DatabaseManager.get_session() as session:
-            paste = (
-                session.query(models.Paste)
-                .filter(models.Paste.removal == removal)
-                .first()
-            )
-
-            if not paste:
-                log.info("RemovePaste.get: someone visited with invalid id")
-                raise tornado.web.HTTPError(404)
+        paste = await manager.DatabaseManager.run(queries.paste_remove, removal)
 
-            if paste.exp_date < datetime.now(timezone.utc):
-                session.delete(paste)
-                session.commit()
+        if not paste:
+            log.info("RemovePaste.get: someone visited with invalid id")
+            raise tornado.web.HTTPError(404)
 
-                log.warning(
-                    "Remove.get: paste was expired, is your cronjob running?"
-                )
+        cache.invalidate(paste.slug)
 
-                raise tornado.web.HTTPError(404)
+        if paste.exp_date < datetime.now(timezone.utc):
+            log.warning(
+                "Remove.get: paste was expired, is your cronjob running?"
+            )
 
-            session.delete(paste)
-            session.commit()
+            raise tornado.web.HTTPError(404)
 
         self.redirect("/")
 
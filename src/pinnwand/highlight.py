@@ -0,0 +1,436 @@
+"""Syntax highlighting of pastes. Highlighting is the most CPU intensive thing
+pinnwand does so it is run in a pool of worker processes to keep the IOLoop
+responsive while large pastes are being created.
+
+The jobs highlighting the files of a paste share a `Budget` for the size of
+their output. Highlighting stops as soon as a paste turns out too large instead
+of after all of its files were highlighted.
+
+Jobs are also limited in time. Files that take too long are highlighted as
+plain text instead."""
+
+import asyncio
+import contextlib
+import hashlib
+import multiprocessing
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Iterator, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # type: ignore
+
+import pygments
+import pygments.lexers
+from pygments_better_html import BetterHtmlFormatter
+
+from pinnwand import error, logger
+from pinnwand.configuration import Configuration, ConfigurationProvider
+
+log = logger.get_logger(__name__)
+
+# The amount of output spent by the jobs being highlighted, one slot per job.
+# This array is shared with the worker processes.
+BUDGET_SLOTS = 1024
+
+_budgets: Any = None
+
+# Whether this is a worker process, which can be ended when it runs away
+_worker = False
+
+
+def _initialize(budgets: Any) -> None:
+    """Set up a worker process with the shared budgets."""
+    global _budgets, _worker
+    _budgets = budgets
+    _worker = True
+
+
+class Budget:
+    """The amount of highlighted output the files of a paste may produce
+    together. Jobs in different processes share a budget through the shared
+    budgets: each job publishes what it spent to its own `slot` and sums the
+    `slots` of all jobs of its paste. Without a slot the budget is only for a
+    single job.
+
+    A slot is only written by its own job so the shared budgets have no
+    lock, a worker process that is ended mid-job can't leave it held."""
+
+    # Output is published in steps of this size, to not sum the slots for
+    # every line
+    step = 16 * 1024
+
+    def __init__(
+        self,
+        limit: int,
+        slot: Optional[int] = None,
+        slots: Tuple[int, ...] = (),
+    ) -> None:
+        self.limit = limit
+        self.slot = slot
+        self.slots = slots or (() if slot is None else (slot,))
+        self.total = 0
+        self.pending = 0
+        self.spent = 0
+
+    def spend(self, amount: int) -> None:
+        """Spend some output, raises a `ValidationError` once the budget is
+        exceeded."""
+        self.pending += amount
+
+        if self.pending >= self.step:
+            self.publish()
+
+        self.check()
+
+    def check(self) -> None:
+        """Raise a `ValidationError` if the budget is exceeded."""
+        if self.total + self.pending > self.limit:
+            raise error.ValidationError(
+                f"Highlighted text exceeds size limit ({self.limit//1024} kB)"
+            )
+
+    def publish(self) -> None:
+        """Publish pending output to the slot of this job, and see how much
+        the other jobs spent."""
+        self.spent += self.pending
+        self.pending = 0
+
+        if self.slot is None or _budgets is None:
+            self.total = self.spent
+        else:
+            _budgets[self.slot] = self.spent
+            self.total = sum(_budgets[slot] for slot in self.slots)
+
+    def refund(self) -> None:
+        """Take back everything spent so far, to start over."""
+        self.pending = -self.spent
+        self.publish()
+
+
+class BudgetHtmlFormatter(BetterHtmlFormatter):
+    """Spend every line from a budget as it's formatted. Line numbers in a
+    table are only written out after all lines are formatted, counting what
+    is written would be too late."""
+
+    # The markup each line is wrapped in at the least, for its table row
+    row = len(
+        '<tr><td class="linenos linenodiv"><code data-line-number="">'
+        '</code></td><td class="code"><code></code></td></tr>'
+    )
+
+    def __init__(self, budget: Optional[Budget] = None, **options: Any) -> None:
+        super().__init__(**options)
+        self.budget = budget
+
+    def _format_lines(self, tokensource: Any) -> Any:
+        for kind, line in super()._format_lines(tokensource):
+            if self.budget is not None:
+                self.budget.spend(len(line) + self.row)
+
+            yield kind, line
+
+        # What's left is shared too, one of the last jobs to finish sees what
+        # all of them spent
+        if self.budget is not None:
+            self.budget.publish()
+            self.budget.check()
+
+
+class Timeout(Exception):
+    """Highlighting took longer than it may."""
+
+
+@contextlib.contextmanager
+def time_limit(
+    wall_time: Optional[float], cpu_time: Optional[float]
+) -> Iterator[None]:
+    """Raise `Timeout` in the block once it took `wall_time` seconds or used
+    `cpu_time` seconds of CPU time. The timers use signals so the block only
+    has limits on the main thread."""
+
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expire(signum: int, frame: Any) -> None:
+        raise Timeout()
+
+    previous = {
+        signal.SIGALRM: signal.signal(signal.SIGALRM, expire),
+        signal.SIGPROF: signal.signal(signal.SIGPROF, expire),
+    }
+
+    try:
+        if wall_time:
+            signal.setitimer(signal.ITIMER_REAL, wall_time)
+
+        if cpu_time:
+            signal.setitimer(signal.ITIMER_PROF, cpu_time)
+
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.setitimer(signal.ITIMER_PROF, 0)
+
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+
+def cpu_backstop(cpu_time: Optional[float]) -> None:
+    """Have the operating system end a worker process once its job uses twice
+    its `cpu_time`, for jobs that are stuck where the timers of `time_limit`
+    can't interrupt them. The pool replaces the process."""
+
+    if not _worker or resource is None or not cpu_time:
+        return
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+
+    limit = int(usage.ru_utime + usage.ru_stime + cpu_time * 2) + 1
+
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+
+
+def digest(raw: str) -> str:
+    """Identify text in logs without logging the text."""
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def render(
+    raw: str,
+    lexer: str,
+    filename: Optional[str] = None,
+    budget: Optional[Budget] = None,
+    wall_time: Optional[float] = None,
+    cpu_time: Optional[float] = None,
+) -> str:
+    """Highlight `raw` with the lexer by the name of `lexer` and return the
+    resulting HTML. This is a plain function so it can be shipped off to a
+    worker process. Highlighting stops with a `ValidationError` when a
+    `budget` runs out.
+
+    When highlighting takes longer than `wall_time` seconds or `cpu_time`
+    seconds of CPU time the text is highlighted with the `text` lexer
+    instead."""
+
+    cpu_backstop(cpu_time)
+
+    try:
+        with time_limit(wall_time, cpu_time):
+            return _render(raw, lexer, filename, budget)
+    except Timeout:
+        log.warning(
+            "render: highlighting with %s timed out for %s, used text",
+            lexer,
+            digest(raw),
+        )
+
+    if budget is not None:
+        budget.refund()
+
+    return _render(raw, "text", filename, budget)
+
+
+def _render(
+    raw: str,
+    lexer: str,
+    filename: Optional[str] = None,
+    budget: Optional[Budget] = None,
+) -> str:
+    from pinnwand import utility
+
+    if lexer == "autodetect":
+        lexer = utility.guess_language(raw, filename)
+        log.debug(f"Language guessed as {lexer}")
+
+    formatter = BudgetHtmlFormatter(  # pylint: disable=no-member
+        budget, linenos="table", cssclass="source"
+    )
+
+    return str(
+        pygments.highlight(
+            raw, pygments.lexers.get_lexer_by_name(lexer), formatter
+        )
+    )
+
+
+class HighlightManager:
+    """An entity responsible for the process pool that highlighting jobs are
+    sent to."""
+
+    _executor: Optional[ProcessPoolExecutor] = None
+
+    # The amount of server processes that `highlight_workers` is divided over
+    _processes: int = 1
+
+    # Slots in the shared budgets that aren't used by a paste
+    _slots: List[int] = []
+
+    @classmethod
+    def get_budgets(cls) -> Any:
+        """Return the budgets shared with the worker processes."""
+        global _budgets
+
+        if _budgets is None:
+            _budgets = multiprocessing.get_context("spawn").Array(
+                "q", BUDGET_SLOTS, lock=False
+            )
+            cls._slots = list(range(BUDGET_SLOTS))
+
+        return _budgets
+
+    @classmethod
+    def share(cls, processes: int) -> None:
+        """Divide the `highlight_workers` between `processes` server
+        processes, each of them gets an equal part of them for its pool."""
+        cls._processes = processes
+
+    @classmethod
+    def get_executor(cls) -> Optional[ProcessPoolExecutor]:
+        """Return the process pool for highlighting, or `None` when
+        highlighting is configured to happen in-process."""
+        configuration: Configuration = ConfigurationProvider.get_config()
+
+        if not configuration.highlight_workers:
+            return None
+
+        if not cls._executor:
+            # Workers are spawned instead of forked, the parent process has
+            # threads and an event loop that we'd rather not duplicate.
+            cls._executor = ProcessPoolExecutor(
+                max_workers=max(
+                    configuration.highlight_workers // cls._processes, 1
+                ),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_initialize,
+                initargs=(cls.get_budgets(),),
+            )
+
+        return cls._executor
+
+    @classmethod
+    def shutdown(cls) -> None:
+        """Shut down the process pool, a new one is created on next use."""
+        if cls._executor:
+            cls._executor.shutdown(wait=False, cancel_futures=True)
+            cls._executor = None
+
+    @classmethod
+    async def render(
+        cls,
+        raw: str,
+        lexer: str,
+        filename: Optional[str] = None,
+        budget: Optional[Budget] = None,
+    ) -> str:
+        """Highlight a single file in the process pool. Without a `budget`
+        its output gets the budget of an entire paste."""
+        configuration: Configuration = ConfigurationProvider.get_config()
+
+        # Don't spend any time on text that will be refused anyway
+        if len(raw) > configuration.paste_size:
+            raise error.ValidationError(
+                f"Text exceeds size limit {configuration.paste_size//1024} (kB)"
+            )
+
+        if budget is None:
+            budget = Budget(configuration.paste_size)
+
+        limits = (
+            configuration.highlight_wall_time,
+            configuration.highlight_cpu_time,
+        )
+
+        executor = cls.get_executor()
+
+        if executor is None:
+            return render(raw, lexer, filename, budget, *limits)
+
+        loop = asyncio.get_running_loop()
+
+        # A job that ran away ends its worker process, which breaks the pool
+        # for every job that was running on it. Those are ran once more on a
+        # new pool, a job that breaks that as well is highlighted as text.
+        for _ in range(2):
+            try:
+                return await loop.run_in_executor(
+                    executor, render, raw, lexer, filename, budget, *limits
+                )
+            except BrokenProcessPool:
+                # Take back what the job published before its process ended,
+                # this copy of the budget spent nothing so refunding it
+                # publishes nothing spent to the job's slot
+                budget.refund()
+
+                if cls._executor is executor:
+                    cls.shutdown()
+
+                executor = cls.get_executor()
+
+        log.warning(
+            "render: highlighting with %s was killed for %s, used text",
+            lexer,
+            digest(raw),
+        )
+
+        return await loop.run_in_executor(
+            executor, render, raw, "text", filename, budget, *limits
+        )
+
+    @classmethod
+    async def render_many(
+        cls, sources: List[Tuple[str, str, Optional[str]]]
+    ) -> List[str]:
+        """Highlight a list of `(raw, lexer, filename)` tuples, one job per
+        file, and return the results in order. The files share a budget of
+        the size of a paste."""
+        configuration: Configuration = ConfigurationProvider.get_config()
+
+        budgets = cls.get_budgets()
+
+        # Every job gets a slot, when there aren't enough of them free each
+        # file gets a budget of its own
+        slots: Tuple[int, ...] = ()
+
+        if len(cls._slots) >= len(sources):
+            slots = tuple(cls._slots.pop() for _ in sources)
+
+        for slot in slots:
+            budgets[slot] = 0
+
+        try:
+            # Wait for all jobs, even when one failed, as the others still
+            # publish to their slots
+            results = await asyncio.gather(
+                *(
+                    cls.render(
+                        raw,
+                        lexer,
+                        filename,
+                        Budget(
+                            configuration.paste_size,
+                            slots[index] if slots else None,
+                            slots,
+                        ),
+                    )
+                    for index, (raw, lexer, filename) in enumerate(sources)
+                ),
+                return_exceptions=True,
+            )
+        finally:
+            cls._slots.extend(slots)
+
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        return list(results)  # type: ignore
@@ -214,6 +214,15 @@ function setupColorScheme() {
 }
 
 function setupShowPage() {
+    // The removal cookie is only sent to the creator of a paste, the page
+    // itself is the same for everyone.
+    let removeLink = document.querySelector("a.remove-now");
+    let removal = getCookie("removal");
+    if(removeLink != null && removal) {
+        removeLink.href = "/remove/" + encodeURIComponent(removal);
+        removeLink.hidden = false;
+    }
+
     let wordWrapButton = document.getElementById("toggle-word-wrap");
     if(wordWrapButton != null) {
         wordWrapButton.addEventListener("click", function(event) {
@@ -247,6 +256,16 @@ function setupShowPage() {
     return false;
 }
 
+function getCookie(name) {
+    for (let cookie of document.cookie.split(";")) {
+        let [key, ...value] = cookie.trim().split("=");
+        if (key === name) {
+            return decodeURIComponent(value.join("="));
+        }
+    }
+    return null;
+}
+
 function setupCreatePage() {
     setupFileDrop();
 
@@ -1,23 +1,48 @@
+import array
+import asyncio
+import email.utils
+import fnmatch
+import functools
+import hashlib
 import math
+import os.path
 import re
+import struct
+import sys
+import threading
+import time
 from base64 import b32encode
 from datetime import datetime, timezone
 from os import urandom
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import tornado.escape
+from tornado.httputil import HTTPServerRequest
+from tornado.web import RequestHandler
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm.session import Session
 
 from pygments.lexers import (
+    find_lexer_class_by_name,
     get_all_lexers,
     guess_lexer,
     guess_lexer_for_filename,
 )
+from pygments.util import ClassNotFound
 
 from pinnwand import logger
+from pinnwand.configuration import Configuration, ConfigurationProvider
 from pinnwand.database import manager, models
 
 log = logger.get_logger(__name__)
 
 
+@functools.lru_cache(maxsize=None)
 def list_languages() -> Dict[str, str]:
+    """Map the names of all available lexers to their human readable names.
+    The lexers don't change while running so this is built once and the same
+    dictionary is returned on every call, don't modify it."""
+
     # Start with converting the pygments lexers index into a dict.
     lexers = {
         lexer[1][0]: lexer[0]
@@ -36,26 +61,208 @@ def list_languages() -> Dict[str, str]:
     return dict(sorted(lexers.items(), key=lambda x: x[1]))  # type: ignore
 
 
+@functools.lru_cache(maxsize=None)
+def list_languages_json() -> Tuple[bytes, str]:
+    """Return `list_languages` serialized as JSON together with an ETag for
+    it, for the endpoints that list lexers."""
+
+    body = tornado.escape.utf8(tornado.escape.json_encode(list_languages()))
+
+    return body, f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+def write_languages_json(handler: RequestHandler) -> None:
+    """Answer a request for the lexer list with `list_languages_json`, or
+    with a 304 when the client's copy is current."""
+
+    body, etag = list_languages_json()
+
+    handler.set_header("Etag", etag)
+
+    if handler.check_etag_header():
+        handler.set_status(304)
+        return
+
+    handler.set_header("Content-Type", "application/json; charset=UTF-8")
+    handler.write(body)
+
+
 GUESS_LANG_OVERRIDES = {"as3": "yaml", "python2": "python"}
 
 GUESS_LANG_IGNORES = ["mime", "tsql"]
 
 
+# Only this much of the start of a text is analysed by Pygments to guess its
+# language, analysing all of a large paste takes long and doesn't guess better
+GUESS_LANG_SAMPLE = 16 * 1024
+
+# Interpreters that aren't also the name of a lexer
+GUESS_LANG_INTERPRETERS = {
+    "node": "javascript",
+    "nodejs": "javascript",
+    "tclsh": "tcl",
+    "wish": "tcl",
+}
+
+_shebang = re.compile(r"#!\s*(\S+)((?:[ \t]+\S+)*)")
+
+# `-*- mode: python -*-` or `-*- python -*-` in the first line
+_modeline_emacs = re.compile(
+    r"-\*-\s*(?:.*?\bmode:\s*)?([\w+#-]+)\s*(?:;.*?)?-\*-", re.IGNORECASE
+)
+
+# `vim: set ft=python:` or `vi: filetype=python` in the first or last lines
+_modeline_vim = re.compile(
+    r"(?:^|\s)(?:vim?|ex):.*?\b(?:ft|filetype|syntax)=([\w+#-]+)"
+)
+
+
+def _language_by_name(name: str) -> Optional[str]:
+    """Return the language for the name of a lexer, if there is one."""
+    try:
+        return str(find_lexer_class_by_name(name.lower()).aliases[0])
+    except (ClassNotFound, IndexError):
+        return None
+
+
+def _language_by_shebang(line: str) -> Optional[str]:
+    """Return the language of the interpreter in a shebang line."""
+    match = _shebang.match(line)
+
+    if not match:
+        return None
+
+    interpreter = os.path.basename(match.group(1))
+
+    # The interpreter is found on the `PATH` by env, skip its options
+    if interpreter == "env":
+        interpreter = next(
+            (arg for arg in match.group(2).split() if not arg.startswith("-")),
+            "",
+        )
+
+    for name in (interpreter, interpreter.rstrip("0123456789.")):
+        if not name:
+            continue
+
+        language = _language_by_name(GUESS_LANG_INTERPRETERS.get(name, name))
+
+        if language:
+            return language
+
+    return None
+
+
+def _language_by_modeline(head: List[str], tail: List[str]) -> Optional[str]:
+    """Return the language set by an Emacs modeline in the first lines or
+    a Vim modeline in the first or last lines."""
+
+    for line in head[:2]:
+        match = _modeline_emacs.search(line)
+
+        if match:
+            return _language_by_name(match.group(1))
+
+    for line in head + tail:
+        match = _modeline_vim.search(line)
+
+        if match:
+            return _language_by_name(match.group(1))
+
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _filename_patterns() -> Tuple[Dict[str, Set[str]], List[Tuple[str, str]]]:
+    """Map extensions to the languages that have a filename pattern for it,
+    and list the patterns that are more than an extension along with their
+    languages. Built once as it loads every lexer."""
+
+    extensions: Dict[str, Set[str]] = {}
+    patterns: List[Tuple[str, str]] = []
+
+    for _, aliases, _, _ in get_all_lexers():
+        if not aliases:
+            continue
+
+        try:
+            lexer = find_lexer_class_by_name(aliases[0])
+        except ClassNotFound:
+            continue
+
+        for pattern in list(lexer.filenames) + list(lexer.alias_filenames):
+            if re.fullmatch(r"\*\.[^*?\[\].]+", pattern):
+                extensions.setdefault(pattern[2:], set()).add(aliases[0])
+            else:
+                patterns.append((pattern, aliases[0]))
+
+    return extensions, patterns
+
+
+def _languages_by_filename(filename: str) -> Set[str]:
+    """Return the languages with a filename pattern that matches a
+    filename, the same way Pygments matches them."""
+
+    name = os.path.basename(filename)
+    extensions, patterns = _filename_patterns()
+
+    _, dot, extension = name.rpartition(".")
+
+    languages = set(extensions.get(extension, ())) if dot else set()
+    languages.update(
+        language
+        for pattern, language in patterns
+        if fnmatch.fnmatchcase(name, pattern)
+    )
+
+    return languages
+
+
 def guess_language(raw: str, filename: Optional[str] = None) -> str:
+    """Guess the language of a text. What the text says about itself in a
+    shebang or modeline is checked first, then whether its filename belongs
+    to a single language. Only when those don't tell is the start of the
+    text analysed by Pygments."""
+
     options = {"stripnl": True}
 
+    sample = raw[:GUESS_LANG_SAMPLE]
+
+    # Only the first and last lines can hold a shebang or modeline
+    head = sample.lstrip().splitlines()[:5]
+    tail = raw[-GUESS_LANG_SAMPLE:].splitlines()[-5:]
+
+    language = None
+
+    if head and head[0].startswith("#!"):
+        language = _language_by_shebang(head[0])
+
+    if not language:
+        language = _language_by_modeline(head, tail)
+
+    if language:
+        return GUESS_LANG_OVERRIDES.get(language, language)
+
     # Guess a lexer based on filename and raw text first
     if filename:
-        try:
-            return str(
-                guess_lexer_for_filename(filename, raw, **options).aliases[0]
-            )
-        except (ValueError, IndexError):
-            pass
+        languages = _languages_by_filename(filename)
+
+        if len(languages) == 1:
+            return languages.pop()
+
+        if languages:
+            try:
+                return str(
+                    guess_lexer_for_filename(
+                        filename, sample, **options
+                    ).aliases[0]
+                )
+            except (ValueError, IndexError):
+                pass
 
     # If that didn't work guess lexer just by looking at the raw text
     try:
-        language = str(guess_lexer(raw, **options).aliases[0])
+        language = str(guess_lexer(sample, **options).aliases[0])
     except (ValueError, IndexError):
         # If no lexer was detected, fallback to plain text.
         return "text"
@@ -76,72 +283,178 @@ def hash_create(length: int = 16) -> str:
     return b32encode(urandom(length)).decode("ascii").replace("=", "")
 
 
-def slug_create(
-    auto_scale: bool = True, dont_use: Optional[List[str]] = None
-) -> str:
-    """Creates a new slug, a slug has to be unique within both the Paste and
-    File namespace. These slugs auto-lengthen unless they are specified not
-    to.
+class ObjectCount:
+    """Keeps an approximate count of the pastes and files in the database. The
+    length of new slugs is based on this count, counting the tables for every
+    slug gets slow once they're large.
+
+    The tables are counted once and the count is then kept up to date by the
+    code that creates and removes pastes. Every so often the tables are
+    counted again to pick up changes made by other processes."""
+
+    _count: Optional[int] = None
+    _counted: float = 0.0
+    _lock = threading.Lock()
+
+    # Seconds after which the tables are counted again.
+    refresh = 600
+
+    @classmethod
+    def get(cls, session: Session) -> int:
+        """Return the approximate amount of pastes and files, `session` is
+        used when the tables need to be counted."""
+        with cls._lock:
+            if (
+                cls._count is not None
+                and time.monotonic() - cls._counted < cls.refresh
+            ):
+                return cls._count
+
+        count = (
+            session.query(models.Paste).count()
+            + session.query(models.File).count()
+        )
 
-    Slugs are unique identifiers that are used the URLs that pinnwand serves
-    pastes and files on."""
+        with cls._lock:
+            cls._count = count
+            cls._counted = time.monotonic()
+
+        return count
+
+    @classmethod
+    def add(cls, amount: int) -> None:
+        """Adjust the count by `amount` objects that were created, or removed
+        when negative."""
+        with cls._lock:
+            if cls._count is not None:
+                cls._count = max(0, cls._count + amount)
+
+    @classmethod
+    def reset(cls) -> None:
+        """Forget the count so the tables are counted on next use."""
+        with cls._lock:
+            cls._count = None
+
+
+def slugs_create(
+    session: Session,
+    amount: int,
+    auto_scale: bool = True,
+    dont_use: Optional[List[str]] = None,
+) -> List[str]:
+    """Creates `amount` new slugs in one go, a slug has to be unique within
+    both the Paste and File namespace. These slugs auto-lengthen unless they
+    are specified not to.
+
+    All candidates are checked against the database with a single query and
+    only the ones that collide are generated again."""
 
     if dont_use is None:
         dont_use = []
 
-    with manager.DatabaseManager.get_session() as session:
-        if auto_scale:
-            # We count our new paste as well
-            count = (
-                session.query(models.Paste).count()
-                + session.query(models.File).count()
-                + len(dont_use)
-                + 1
-            )
+    if auto_scale:
+        # We count our new slugs as well
+        count = ObjectCount.get(session) + len(dont_use) + amount
 
-            # The amount of bits necessary to store that count times two, then
-            # converted to bytes with a minimum of 1.
+        # The amount of bits necessary to store that count times two, then
+        # converted to bytes with a minimum of 1.
 
-            # We double the count so that we always keep half of the space
-            # available (e.g we increase the number of bytes at 127 instead of
-            # 255). This ensures that the probing below can find an empty space
-            # fast in case of collision.
-            necessary = math.ceil(math.log2(count * 2)) // 8 + 1
-        else:
-            necessary = 16  # 16 bytes should do, right?
-
-        # Now generate random ids in the range with a maximum amount of
-        # retries, continuing until an empty slot is found
-        tries = 0
-        slug = hash_create(necessary)
-
-        # If a slug exists in either the Paste or File namespace create a new
-        # one, we also check if we've already generated this slug.
-        while any(
-            (
-                session.query(models.Paste).filter_by(slug=slug).one_or_none(),
-                session.query(models.File).filter_by(slug=slug).one_or_none(),
-                slug in dont_use,
-            )
-        ):
-            log.debug("slug_create: triggered a collision")
-            if tries > 10:
-                raise RuntimeError("We exceeded our retry quota on a collision")
-            tries += 1
+        # We double the count so that we always keep half of the space
+        # available (e.g we increase the number of bytes at 127 instead of
+        # 255). This ensures that the probing below can find an empty space
+        # fast in case of collision.
+        necessary = math.ceil(math.log2(count * 2)) // 8 + 1
+    else:
+        necessary = 16  # 16 bytes should do, right?
+
+    slugs: List[str] = []
+    unavailable = set(dont_use)
+
+    # Now generate random ids in the range with a maximum amount of
+    # retries, continuing until enough empty slots are found
+    tries = 0
+
+    while True:
+        candidates: Set[str] = set()
+        misses = 0
+
+        # We also check if we've already generated this slug, each slug gets
+        # the same amount of retries for that.
+        while len(candidates) < amount - len(slugs):
             slug = hash_create(necessary)
 
-        return slug
+            if slug in unavailable or slug in candidates:
+                log.debug("slugs_create: triggered a collision")
+
+                if misses > 10:
+                    raise RuntimeError(
+                        "We exceeded our retry quota on a collision"
+                    )
+
+                misses += 1
+                continue
+
+            candidates.add(slug)
+            misses = 0
+
+        # If a slug exists in either the Paste or File namespace we need to
+        # create a new one.
+        taken = set(
+            session.scalars(
+                select(models.Paste.slug)
+                .where(models.Paste.slug.in_(candidates))
+                .union(
+                    select(models.File.slug).where(
+                        models.File.slug.in_(candidates)
+                    )
+                )
+            )
+        )
+
+        slugs.extend(candidates - taken)
+        unavailable.update(candidates)
+
+        if len(slugs) == amount:
+            return slugs
+
+        log.debug("slugs_create: triggered %d collisions", len(taken))
+
+        if tries > 10:
+            raise RuntimeError("We exceeded our retry quota on a collision")
+
+        tries += 1
+
+
+def slug_create(
+    auto_scale: bool = True, dont_use: Optional[List[str]] = None
+) -> str:
+    """Creates a new slug, see `slugs_create`.
+
+    Slugs are unique identifiers that are used the URLs that pinnwand serves
+    pastes and files on."""
+
+    with manager.DatabaseManager.get_session() as session:
+        return slugs_create(session, 1, auto_scale, dont_use)[0]
 
 
 class SlugContext:
     """Since pinnwand often has to create multiple slugs in one go without
     generating any duplicates we have a context that keeps track of slugs
     already created in the current grouping. See issue #34 for more
-    information on the *why*."""
+    information on the *why*.
+
+    Slugs can be reserved in bulk with `reserve` when it is known up front
+    how many are needed, `next` hands them out. If a `session` is passed it
+    is used to check for collisions, otherwise a session is created for every
+    batch of slugs."""
 
-    def __init__(self, auto_scale: bool = True) -> None:
+    def __init__(
+        self, auto_scale: bool = True, session: Optional[Session] = None
+    ) -> None:
         self._slugs: List[str] = []
+        self._reserved: List[str] = []
         self._auto_scale = auto_scale
+        self._session = session
 
     def __enter__(self) -> "SlugContext":
         return self
@@ -149,11 +462,27 @@ class SlugContext:
     def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
         return None
 
+    def reserve(self, amount: int) -> None:
+        """Create `amount` slugs for use by `next` with a single query."""
+        dont_use = self._slugs + self._reserved
+
+        if self._session is None:
+            with manager.DatabaseManager.get_session() as session:
+                slugs = slugs_create(
+                    session, amount, self._auto_scale, dont_use
+                )
+        else:
+            slugs = slugs_create(
+                self._session, amount, self._auto_scale, dont_use
+            )
+
+        self._reserved.extend(slugs)
+
     def __next__(self) -> str:
-        slug = slug_create(
-            self._auto_scale,
-            self._slugs,
-        )
+        if not self._reserved:
+            self.reserve(1)
+
+        slug = self._reserved.pop(0)
         self._slugs.append(slug)
         return slug
 
@@ -185,25 +514,378 @@ def filename_clean(filename: str) -> str:
     return re.sub(r"[^A-Za-z0-9-_]", "", filename)
 
 
-def reap() -> None:
-    """Delete all pastes that are past their expiry date in pinnwand's
-    database."""
+def line_index(text: str) -> bytes:
+    """Index the lines of a text as the offsets at which each of them starts,
+    packed as little endian 32 bit integers. Lines end after a newline."""
 
-    with manager.DatabaseManager.get_session() as session:
-        pastes = (
-            session.query(models.Paste)
-            .filter(models.Paste.exp_date < datetime.now(timezone.utc))
-            .all()
+    offsets = array.array("I", [0])
+    position = text.find("\n")
+
+    while position != -1 and position + 1 < len(text):
+        offsets.append(position + 1)
+        position = text.find("\n", position + 1)
+
+    if sys.byteorder != "little":
+        offsets.byteswap()
+
+    return offsets.tobytes()
+
+
+def line_slice(
+    text: str, index: bytes, first: int, last: Optional[int] = None
+) -> str:
+    """Return lines `first` up to and including `last` of a text, counting
+    from one, by its `line_index`. Without `last` the text from `first` on is
+    returned."""
+
+    # Only the two offsets that are needed are read from the index
+    count = len(index) // 4
+
+    if first > count:
+        return ""
+
+    (start,) = struct.unpack_from("<I", index, 4 * (first - 1))
+
+    if last is None or last >= count:
+        return text[start:]
+
+    (end,) = struct.unpack_from("<I", index, 4 * last)
+
+    return text[start:end]
+
+
+def parse_lines(value: str) -> Tuple[int, Optional[int]]:
+    """Parse a range of lines such as `100-200`, `100-` or `100` into its
+    first and last line. Raises `ValueError` when it isn't a range of lines
+    counting from one."""
+
+    first, separator, last = value.strip().partition("-")
+
+    if not first.isdigit() or (last and not last.isdigit()):
+        raise ValueError(f"Invalid range of lines {value!r}")
+
+    start = int(first)
+
+    if not separator:
+        end: Optional[int] = start
+    elif not last:
+        end = None
+    else:
+        end = int(last)
+
+    if start < 1 or (end is not None and end < start):
+        raise ValueError(f"Invalid range of lines {value!r}")
+
+    return start, end
+
+
+# Bytes shown on each line of a hexdump
+HEXDUMP_WIDTH = 16
+
+# Bytes that aren't printable ASCII are shown as a dot in the gutter
+_hexdump_gutter = bytes(
+    byte if 0x20 <= byte < 0x7F else ord(".") for byte in range(256)
+)
+
+
+def hexdump(data: bytes, offset: int = 0) -> str:
+    """Format data as a canonical hexdump, as `hexdump -C` does: the offset of
+    each line, its bytes in hex and an ASCII gutter. `offset` is where `data`
+    starts in whatever it was taken from."""
+
+    lines = []
+    half = HEXDUMP_WIDTH // 2
+
+    for start in range(0, len(data), HEXDUMP_WIDTH):
+        line = data[start : start + HEXDUMP_WIDTH]
+        gutter = line.translate(_hexdump_gutter).decode("ascii")
+
+        lines.append(
+            f"{offset + start:08x}  "
+            f"{line[:half].hex(' '):<{half * 3 - 1}}  "
+            f"{line[half:].hex(' '):<{half * 3 - 1}}  "
+            f"|{gutter}|\n"
         )
 
-        for paste in pastes:
-            session.delete(paste)
+    return "".join(lines)
+
+
+def accepts_encoding(header: str, encoding: str) -> bool:
+    """Does an `Accept-Encoding` header allow a response in `encoding`? An
+    encoding is acceptable when it, or `*`, is listed without a quality of
+    zero."""
+
+    accepted: Dict[str, float] = {}
+
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        accepted[name.strip().lower()] = quality
+
+    return accepted.get(encoding, accepted.get("*", 0.0)) > 0
+
+
+def negotiate_encoding(header: str, encodings: Sequence[str]) -> Optional[str]:
+    """Return the first of `encodings` that an `Accept-Encoding` header
+    allows, if any."""
+
+    for encoding in encodings:
+        if accepts_encoding(header, encoding):
+            return encoding
+
+    return None
+
+
+def is_conditional(request: HTTPServerRequest) -> bool:
+    """Does a request carry validators that a 304 could be answered to?"""
+    return (
+        "If-None-Match" in request.headers
+        or "If-Modified-Since" in request.headers
+    )
+
+
+def cache_etag(
+    slug: str, pub_date: datetime, variant: str = "", weak: bool = False
+) -> str:
+    """Return the quoted ETag for a representation of something that never
+    changes after its publication, see `set_cache_headers`."""
+
+    etag = hashlib.sha1(
+        f"{slug}:{pub_date.isoformat()}:{variant}".encode("utf-8")
+    ).hexdigest()
+
+    return f'W/"{etag}"' if weak else f'"{etag}"'
+
+
+def set_cache_headers(
+    handler: RequestHandler,
+    slug: str,
+    pub_date: datetime,
+    exp_date: Optional[datetime],
+    variant: str = "",
+    weak: bool = False,
+) -> bool:
+    """Set the validators and freshness of a response for something that
+    never changes after its publication, such as a paste or a file. The ETag
+    is made from what identifies the content instead of the content itself so
+    it can be compared without loading the content. `variant` tells apart the
+    different representations of the same thing.
 
-        session.commit()
+    Responses whose bytes can change while their content doesn't, such as
+    rendered pages after highlighting is redone or archives made with another
+    compression level, pass `weak` to send a weak ETag.
 
-        log.info("reap: removed %d pastes", len(pastes))
+    Returns whether the client's copy is still current, in which case the
+    handler should answer with a 304."""
+
+    handler.set_header("Etag", cache_etag(slug, pub_date, variant, weak))
+    handler.set_header("Last-Modified", pub_date)
+
+    if exp_date is not None:
+        max_age = int((exp_date - datetime.now(timezone.utc)).total_seconds())
+        handler.set_header("Cache-Control", f"max-age={max(max_age, 0)}")
+
+    if "If-None-Match" in handler.request.headers:
+        return handler.check_etag_header()
+
+    if_modified_since = handler.request.headers.get("If-Modified-Since")
+
+    if if_modified_since is None:
+        return False
+
+    try:
+        since = email.utils.parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+
+    return int(pub_date.timestamp()) <= since.timestamp()
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a `Range` header into the `(start, end)` offsets, end exclusive,
+    of the bytes it asks for out of `size`. A range that can't be satisfied
+    has a `start` at or past its `end`.
+
+    Only a single range of bytes is understood. Returns `None` for anything
+    else, the header is then ignored and everything is sent."""
+
+    unit, _, ranges = header.partition("=")
+
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    first, separator, last = ranges.strip().partition("-")
+
+    if not separator:
+        return None
+
+    if not first:
+        # A suffix, the last bytes
+        if not last.isdigit():
+            return None
+
+        length = int(last)
+
+        return (max(size - length, 0) if length else size), size
+
+    if not first.isdigit() or (last and not last.isdigit()):
+        return None
+
+    start = int(first)
+
+    if not last:
+        return start, size
+
+    if int(last) < start:
+        return None
+
+    return start, min(int(last) + 1, size)
+
+
+def if_range(
+    request: HTTPServerRequest, slug: str, pub_date: datetime, variant: str
+) -> bool:
+    """Should the `Range` of a request be served? It should unless it carries
+    an `If-Range` with an ETag or date that isn't current, see
+    `set_cache_headers`."""
+
+    value = request.headers.get("If-Range")
+
+    if value is None:
+        return True
+
+    value = value.strip()
+
+    if value.startswith('"') or value.startswith("W/"):
+        # Weak ETags never match
+        return value == cache_etag(slug, pub_date, variant)
+
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return False
+
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+
+    return int(pub_date.timestamp()) == date.timestamp()
+
+
+def reap() -> Tuple[int, int, int]:
+    """Delete all pastes that are past their expiry date in pinnwand's
+    database.
+
+    Pastes and their files are deleted with set-based statements in batches
+    of `reaping_batch_size` pastes, pausing `reaping_batch_pause` milliseconds
+    in between so other queries get their turn. Nothing is loaded into
+    memory. Returns the amount of pastes, files, and characters of text that
+    were removed."""
+
+    from pinnwand import cache
+
+    configuration: Configuration = ConfigurationProvider.get_config()
+
+    now = datetime.now(timezone.utc)
+
+    pastes = 0
+    files = 0
+    size = 0
+
+    while True:
+        with manager.DatabaseManager.get_session() as session:
+            rows = session.execute(
+                select(models.Paste.id, models.Paste.slug)
+                .where(models.Paste.exp_date < now)
+                .limit(configuration.reaping_batch_size)
+            ).all()
+
+            if not rows:
+                break
+
+            ids = [row.id for row in rows]
+
+            batch_files, batch_size = session.execute(
+                select(
+                    func.count(models.File.id),
+                    func.coalesce(
+                        func.sum(
+                            func.coalesce(func.length(models.File.raw_text), 0)
+                            + func.coalesce(
+                                func.length(models.File.raw_data), 0
+                            )
+                            + func.coalesce(
+                                func.length(models.File.fmt_text), 0
+                            )
+                            + func.coalesce(
+                                func.length(models.File.fmt_data), 0
+                            )
+                        ),
+                        0,
+                    ),
+                ).where(models.File.paste_id.in_(ids))
+            ).one()
+
+            # Files are deleted explicitly as databases created before
+            # `ON DELETE CASCADE` was added to the schema don't cascade.
+            session.execute(
+                delete(models.File)
+                .where(models.File.paste_id.in_(ids))
+                .execution_options(synchronize_session=False)
+            )
+            session.execute(
+                delete(models.Paste)
+                .where(models.Paste.id.in_(ids))
+                .execution_options(synchronize_session=False)
+            )
+
+            session.commit()
+
+        for row in rows:
+            cache.invalidate(row.slug)
+
+        pastes += len(ids)
+        files += batch_files
+        size += batch_size
+
+        if len(ids) < configuration.reaping_batch_size:
+            break
+
+        time.sleep(configuration.reaping_batch_pause / 1000)
+
+    ObjectCount.add(-(pastes + files))
+
+    log.info(
+        "reap: removed %d pastes with %d files, reclaiming %s",
+        pastes,
+        files,
+        size_postfix(size),
+    )
+
+    return pastes, files, size
 
 
 async def async_reap() -> None:
-    """Just the asynchronous definition of `reap`, note: not async."""
-    reap()
+    """The asynchronous definition of `reap`. It runs on a thread of its own
+    so the database threads stay available while it pauses between batches,
+    except for in-memory databases whose only connection belongs to the
+    database thread."""
+
+    if manager.DatabaseManager.is_memory():
+        executor = manager.DatabaseManager.get_executor()
+    else:
+        executor = None
+
+    await asyncio.get_running_loop().run_in_executor(executor, reap)
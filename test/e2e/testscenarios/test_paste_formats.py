@@ -1,5 +1,6 @@
 import pytest
 from playwright.sync_api import Page
+from pinnwand import utility
 from test.e2e.pageobjects.create_paste_page import CreatePastePage
 from test.e2e.pageobjects.view_paste_page import ViewPastePage
 from test.e2e.pageobjects.preview_page import PreviewPage
@@ -32,5 +33,5 @@ def test_hex_format(page: Page, create_paste_page: CreatePastePage):
     preview_page = PreviewPage(page)
     preview_page.should_be_opened()
 
-    hex_text = convert_new_lines(pasted_text).encode("utf-8").hex()
+    hex_text = utility.hexdump(convert_new_lines(pasted_text).encode("utf-8"))
     preview_page.should_have_content(hex_text)
@@ -0,0 +1,8 @@
+import pytest
+
+from pinnwand.database import manager, utils as database_utils
+
+
+@pytest.fixture(autouse=True)
+def tables() -> None:
+    database_utils.create_tables(manager.DatabaseManager.get_engine())
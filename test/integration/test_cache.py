@@ -0,0 +1,220 @@
+import asyncio
+import tempfile
+import time
+import unittest.mock
+
+import pytest
+
+from pinnwand import cache, utility
+from pinnwand.configuration import ConfigurationProvider
+from pinnwand.database import manager, queries, utils as database_utils
+
+
+@pytest.fixture(autouse=True)
+def caches() -> None:
+    cache.PasteCache.clear()
+    cache.MissingCache.clear()
+
+
+def create(expiry: int = 3600, files: int = 1):
+    return queries.paste_create(
+        expiry,
+        "test",
+        [("raw", "text", None, "fmt") for _ in range(files)],
+    )
+
+
+def test_paste_by_slug() -> None:
+    paste = create()
+
+    assert asyncio.run(cache.paste_by_slug(paste.slug)).slug == paste.slug
+    assert asyncio.run(cache.paste_by_slug(paste.slug)).slug == paste.slug
+
+    assert cache.PasteCache.stats()["hits"] == 1
+    assert cache.PasteCache.stats()["misses"] == 1
+
+    assert asyncio.run(cache.paste_by_slug("AAAA")) is None
+
+
+def test_file_by_slug() -> None:
+    paste = create(files=2)
+    slug = paste.files[1].slug
+
+    file = asyncio.run(cache.file_by_slug(slug))
+    assert file.raw == "raw"
+    assert file.paste.slug == paste.slug
+
+    # Only the file was loaded, without its highlighted text
+    assert "fmt_text" not in file.__dict__
+    assert cache.PasteCache.get(paste.slug, False) is None
+    assert cache.PasteCache.get_file(slug).slug == slug
+
+    cache.invalidate(paste.slug)
+    assert cache.PasteCache.get_file(slug) is None
+
+
+def test_paste_by_slug_raw() -> None:
+    paste = create(files=2)
+
+    raw = asyncio.run(cache.paste_by_slug(paste.slug, fmt=False))
+    assert all("fmt_text" not in file.__dict__ for file in raw.files)
+    assert all(file.raw == "raw" for file in raw.files)
+
+    # Showing the paste needs the highlighted text, which then serves raw
+    # requests as well
+    assert cache.PasteCache.get(paste.slug) is None
+
+    full = asyncio.run(cache.paste_by_slug(paste.slug))
+    assert all(file.fmt == "fmt" for file in full.files)
+
+    assert cache.PasteCache.get(paste.slug, False) is full
+
+
+def test_uncached() -> None:
+    configuration = ConfigurationProvider.get_config()
+    paste = create(files=2)
+
+    with unittest.mock.patch.object(configuration, "_cache_size", 0):
+        file = asyncio.run(cache.file_by_slug(paste.files[1].slug))
+
+    assert file.raw == "raw"
+    assert "fmt_text" not in file.__dict__
+    assert cache.PasteCache.stats()["entries"] == 0
+
+
+def test_size() -> None:
+    configuration = ConfigurationProvider.get_config()
+
+    first = create()
+    second = create()
+
+    with unittest.mock.patch.object(
+        configuration, "_cache_size", cache.PasteCache.size_of(first)
+    ):
+        cache.PasteCache.put(first)
+        cache.PasteCache.put(second)
+
+    assert cache.PasteCache.get(first.slug) is None
+    assert cache.PasteCache.get(second.slug) is not None
+
+
+def test_expiry() -> None:
+    paste = create(expiry=1)
+
+    cache.PasteCache.put(paste)
+    assert cache.PasteCache.get(paste.slug) is not None
+
+    with unittest.mock.patch.object(time, "time", lambda: 2**32):
+        assert cache.PasteCache.get(paste.slug) is None
+
+
+def test_invalidate_on_reap() -> None:
+    paste = create(expiry=-1)
+
+    cache.PasteCache.put(paste)
+    utility.reap()
+
+    assert cache.PasteCache.stats()["entries"] == 0
+
+
+def test_single_flight() -> None:
+    paste = create()
+
+    run = manager.DatabaseManager.run
+
+    with unittest.mock.patch.object(
+        manager.DatabaseManager, "run", side_effect=run
+    ) as patched:
+
+        async def load():
+            return await asyncio.gather(
+                *(cache.paste_by_slug(paste.slug) for _ in range(10)),
+                *(cache.file_by_slug(paste.slug) for _ in range(10)),
+            )
+
+        results = asyncio.run(load())
+
+    assert patched.call_count == 2
+    assert all(result is not None for result in results)
+
+
+def test_invalidate_during_load() -> None:
+    paste = create()
+
+    generation = cache.PasteCache.generation()
+    cache.invalidate(paste.slug)
+    cache.PasteCache.put(paste, generation)
+
+    assert cache.PasteCache.get(paste.slug) is None
+
+
+def test_missing() -> None:
+    run = manager.DatabaseManager.run
+
+    with unittest.mock.patch.object(
+        manager.DatabaseManager, "run", side_effect=run
+    ) as patched:
+        for _ in range(3):
+            assert asyncio.run(cache.paste_by_slug("AAAA")) is None
+            assert asyncio.run(cache.file_by_slug("AAAA")) is None
+
+    assert patched.call_count == 1
+    assert cache.MissingCache.has("AAAA")
+
+
+def test_missing_read_engine() -> None:
+    configuration = ConfigurationProvider.get_config()
+
+    with tempfile.NamedTemporaryFile() as f, unittest.mock.patch.object(
+        configuration, "_database_read_uri", f"sqlite:///{f.name}"
+    ):
+        manager.DatabaseManager.dispose()
+
+        try:
+            database_utils.create_tables(manager.DatabaseManager.get_engine())
+            database_utils.create_tables(
+                manager.DatabaseManager.get_read_engine()
+            )
+
+            # Only on the primary, as if the replica lags behind
+            paste, other = create(), create()
+
+            assert asyncio.run(cache.paste_by_slug(paste.slug)) is not None
+            assert (
+                asyncio.run(cache.file_by_slug(other.files[0].slug)) is not None
+            )
+
+            assert asyncio.run(cache.paste_by_slug("AAAA")) is None
+
+            assert not cache.MissingCache.has(paste.slug)
+            assert not cache.MissingCache.has(other.files[0].slug)
+            assert cache.MissingCache.has("AAAA")
+        finally:
+            manager.DatabaseManager.dispose()
+
+
+def test_missing_created_removed() -> None:
+    paste = create()
+
+    cache.MissingCache.add(paste.slug)
+    cache.created(paste)
+
+    assert asyncio.run(cache.paste_by_slug(paste.slug)) is not None
+
+    cache.invalidate(paste.slug)
+
+    assert cache.MissingCache.has(paste.slug)
+
+
+def test_log_stats(caplog: pytest.LogCaptureFixture) -> None:
+    paste = create()
+
+    asyncio.run(cache.paste_by_slug(paste.slug))
+    asyncio.run(cache.paste_by_slug(paste.slug))
+
+    with caplog.at_level("INFO", logger="pinnwand.cache"):
+        cache.log_stats()
+
+    assert "cache: pastes had 1 hits and 1 misses" in caplog.text
+    assert "cache: pages had" in caplog.text
+    assert "cache: missing had" in caplog.text
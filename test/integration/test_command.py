@@ -87,3 +87,130 @@ def test_delete():
 
     result = runner.invoke(command.main, ["delete", "--paste", "unknown"])
     assert result.exit_code == 1
+
+
+def test_http_workers():
+    runner = CliRunner()
+
+    result = runner.invoke(command.main, ["http", "--workers", "-1"])
+    assert result.exit_code == 2
+
+    result = runner.invoke(command.main, ["http", "--workers", "2", "--debug"])
+    assert result.exit_code == 1
+
+
+def test_http_workers_highlight():
+    import unittest.mock
+
+    from pinnwand import highlight
+    from pinnwand.database import manager
+
+    configuration: Configuration = ConfigurationProvider.get_config()
+    runner = CliRunner()
+
+    for workers, expected in (("4", 2), ("0", 1), ("16", 1)):
+        # Everything that would start serving or touch the shared database
+        with unittest.mock.patch.object(
+            configuration, "_highlight_workers", 8
+        ), unittest.mock.patch.object(
+            manager.DatabaseManager, "is_memory", return_value=False
+        ), unittest.mock.patch.object(
+            manager.DatabaseManager, "dispose"
+        ), unittest.mock.patch(
+            "pinnwand.utility.reap"
+        ), unittest.mock.patch(
+            "tornado.netutil.bind_sockets"
+        ), unittest.mock.patch(
+            "tornado.process.cpu_count", return_value=8
+        ), unittest.mock.patch(
+            "tornado.process.fork_processes", return_value=1
+        ), unittest.mock.patch(
+            "tornado.httpserver.HTTPServer"
+        ), unittest.mock.patch(
+            "tornado.ioloop.PeriodicCallback"
+        ), unittest.mock.patch(
+            "tornado.ioloop.IOLoop.current"
+        ):
+            try:
+                result = runner.invoke(
+                    command.main, ["http", "--workers", workers]
+                )
+                assert result.exit_code == 0
+
+                executor = highlight.HighlightManager.get_executor()
+                assert executor._max_workers == expected  # type: ignore
+            finally:
+                highlight.HighlightManager.shutdown()
+                highlight.HighlightManager.share(1)
+
+
+def test_http_workers_languages():
+    import unittest.mock
+
+    from pinnwand import highlight, utility
+    from pinnwand.database import manager
+
+    def fork_processes(workers: int) -> int:
+        # The children inherit the lexers from their parent
+        assert utility.list_languages_json.cache_info().currsize == 1
+        return 1
+
+    utility.list_languages_json.cache_clear()
+
+    with unittest.mock.patch.object(
+        manager.DatabaseManager, "is_memory", return_value=False
+    ), unittest.mock.patch.object(
+        manager.DatabaseManager, "dispose"
+    ), unittest.mock.patch(
+        "pinnwand.utility.reap"
+    ), unittest.mock.patch(
+        "tornado.netutil.bind_sockets"
+    ), unittest.mock.patch(
+        "tornado.process.fork_processes", side_effect=fork_processes
+    ), unittest.mock.patch(
+        "tornado.httpserver.HTTPServer"
+    ), unittest.mock.patch(
+        "tornado.ioloop.PeriodicCallback"
+    ), unittest.mock.patch(
+        "tornado.ioloop.IOLoop.current"
+    ):
+        try:
+            result = CliRunner().invoke(
+                command.main, ["http", "--workers", "2"]
+            )
+            assert result.exit_code == 0, result.exception
+        finally:
+            highlight.HighlightManager.shutdown()
+            highlight.HighlightManager.share(1)
+
+
+def test_compress():
+    import unittest.mock
+
+    from pinnwand.database import manager, queries, utils
+
+    utils.create_tables(manager.DatabaseManager.get_engine())
+
+    paste = queries.paste_create(3600, "test", [("raw", "text", None, "fmt")])
+
+    configuration: Configuration = ConfigurationProvider.get_config()
+    runner = CliRunner()
+
+    for method in ("zlib", None):
+        with unittest.mock.patch.object(
+            configuration, "_storage_compression", method
+        ):
+            result = runner.invoke(
+                command.main, ["compress", "--batch-size", "1"]
+            )
+            assert result.exit_code == 0
+
+        file = queries.file_by_slug(paste.slug)
+        assert file.compression == method
+        assert file.raw == "raw"
+
+    with unittest.mock.patch.object(
+        configuration, "_storage_compression", "lzma"
+    ):
+        result = runner.invoke(command.main, ["compress"])
+        assert result.exit_code == 1
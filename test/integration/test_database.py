@@ -1,7 +1,149 @@
-from pinnwand.database import models
+import asyncio
+import threading
+import unittest.mock
+
+from sqlalchemy import create_engine, inspect, text
+
+from pinnwand.configuration import ConfigurationProvider
+from pinnwand.database import manager, models, queries, utils
 
 
 def test_regression_issue_14() -> None:
     # In #14 it was noticed that the tablename for models is calculated
     # incorrectly. This testcase ensures this bug isn't reintroduced
     assert models.Paste.__tablename__ == "paste"
+
+
+def test_run_off_thread() -> None:
+    assert (
+        asyncio.run(manager.DatabaseManager.run(threading.get_ident))
+        != threading.get_ident()
+    )
+
+
+def test_dispose() -> None:
+    engine = manager.DatabaseManager.get_engine()
+    manager.DatabaseManager.dispose()
+
+    assert manager.DatabaseManager.get_engine() is not engine
+
+
+def test_create_indexes() -> None:
+    engine = create_engine("sqlite:///:memory:")
+    utils.create_tables(engine)
+
+    # Pretend the tables were made before the indexes existed
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_paste_exp_date"))
+        connection.execute(text("DROP INDEX ix_file_paste_id"))
+
+    utils.create_tables(engine)
+
+    inspector = inspect(engine)
+    assert "ix_paste_exp_date" in {
+        index["name"] for index in inspector.get_indexes("paste")
+    }
+    assert "ix_file_paste_id" in {
+        index["name"] for index in inspector.get_indexes("file")
+    }
+
+
+def test_create_columns() -> None:
+    engine = create_engine("sqlite:///:memory:")
+    utils.create_tables(engine)
+
+    # Pretend the tables were made before the column existed
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE file DROP COLUMN compression"))
+
+    utils.create_tables(engine)
+
+    inspector = inspect(engine)
+    assert "compression" in {
+        column["name"] for column in inspector.get_columns("file")
+    }
+
+
+def test_paste_by_slug_columns() -> None:
+    paste = queries.paste_create(3600, "test", [("raw", "text", None, "fmt")])
+
+    paste = queries.paste_by_slug(paste.slug, True, False)
+    assert paste.files[0].raw == "raw"
+    assert "fmt_text" not in paste.files[0].__dict__
+
+    paste = queries.paste_by_slug(paste.slug, False, False)
+    assert "raw_text" not in paste.files[0].__dict__
+
+    file = queries.file_by_slug(paste.slug)
+    assert file.raw == "raw"
+    assert "fmt_text" not in file.__dict__
+
+
+def test_by_slug_expired() -> None:
+    paste = queries.paste_create(-1, "test", [("raw", "text", None, "fmt")])
+
+    assert queries.paste_by_slug(paste.slug) is None
+    assert queries.file_by_slug(paste.slug) is None
+
+    # The paste itself is left for the reaper
+    with manager.DatabaseManager.get_session() as session:
+        assert session.query(models.Paste).filter_by(slug=paste.slug).count()
+
+
+def test_read_engine() -> None:
+    configuration = ConfigurationProvider.get_config()
+
+    assert (
+        manager.DatabaseManager.get_read_engine()
+        is manager.DatabaseManager.get_engine()
+    )
+
+    with unittest.mock.patch.object(
+        configuration, "_database_read_uri", "sqlite:///:memory:"
+    ):
+        manager.DatabaseManager.dispose()
+
+        try:
+            engine = manager.DatabaseManager.get_read_engine()
+            assert engine is not manager.DatabaseManager.get_engine()
+
+            with manager.DatabaseManager.get_session(read=True) as session:
+                assert session.get_bind() is engine
+        finally:
+            manager.DatabaseManager.dispose()
+
+
+def test_compression() -> None:
+    configuration = ConfigurationProvider.get_config()
+
+    with unittest.mock.patch.object(
+        configuration, "_storage_compression", "zlib"
+    ):
+        paste = queries.paste_create(
+            3600, "test", [("raw" * 100, "text", None, "fmt" * 100)]
+        )
+
+    paste = queries.paste_by_slug(paste.slug)
+    file = paste.files[0]
+
+    assert file.compression == "zlib"
+    assert file.raw_text is None
+    assert len(file.raw_data) < 300
+    assert file.raw == "raw" * 100
+    assert file.fmt == "fmt" * 100
+
+
+def test_lines() -> None:
+    raw = "".join(f"{line}\n" for line in range(1, 1001))
+    paste = queries.paste_create(3600, "test", [(raw, "text", None, "fmt")])
+
+    file = queries.file_by_slug(paste.slug)
+
+    assert file.line_index is not None
+    assert file.lines(100, 102) == "100\n101\n102\n"
+    assert file.lines(1000) == "1000\n"
+    assert file.lines(1001) == ""
+
+    # Files that weren't indexed
+    file.line_index = None
+    assert file.lines(100, 102) == "100\n101\n102\n"
@@ -0,0 +1,172 @@
+import asyncio
+import concurrent.futures
+import unittest.mock
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+import pytest
+
+from pinnwand import error, highlight
+from pinnwand.configuration import Configuration, ConfigurationProvider
+
+configuration: Configuration = ConfigurationProvider.get_config()
+
+
+def test_render() -> None:
+    assert "source" in highlight.render("import os", "python")
+    assert "source" in highlight.render("import os", "autodetect", "a.py")
+
+
+def test_render_many() -> None:
+    sources = [
+        ("foo", "text", None),
+        ("import os", "python", "a.py"),
+        ("int main;", "c", None),
+    ]
+
+    fmts = asyncio.run(highlight.HighlightManager.render_many(sources))
+
+    assert fmts == [highlight.render(*source) for source in sources]
+
+
+def test_render_many_budget() -> None:
+    # Each file fits on its own, together they don't
+    raw = ("a" * 99 + "\n") * (configuration.paste_size // 600)
+    assert len(highlight.render(raw, "text")) < configuration.paste_size / 2
+
+    with pytest.raises(error.ValidationError):
+        asyncio.run(
+            highlight.HighlightManager.render_many([(raw, "text", None)] * 3)
+        )
+
+    assert len(highlight.HighlightManager._slots) == highlight.BUDGET_SLOTS
+
+
+def test_budget() -> None:
+    budget = highlight.Budget(100)
+    budget.spend(100)
+
+    with pytest.raises(error.ValidationError):
+        budget.spend(1)
+
+    with pytest.raises(error.ValidationError):
+        highlight.render("a" * 1000, "text", budget=highlight.Budget(100))
+
+
+def test_budget_slots() -> None:
+    budgets = highlight.HighlightManager.get_budgets()
+
+    # There's no lock for an ended worker process to leave held
+    assert not hasattr(budgets, "get_lock")
+
+    slots = (
+        highlight.HighlightManager._slots.pop(),
+        highlight.HighlightManager._slots.pop(),
+    )
+
+    try:
+        for slot in slots:
+            budgets[slot] = 0
+
+        first = highlight.Budget(100, slots[0], slots)
+        second = highlight.Budget(100, slots[1], slots)
+
+        first.spend(60)
+        first.publish()
+        second.spend(40)
+        second.publish()
+
+        assert budgets[slots[0]] == 60
+        assert budgets[slots[1]] == 40
+
+        with pytest.raises(error.ValidationError):
+            second.spend(1)
+    finally:
+        highlight.HighlightManager._slots.extend(slots)
+
+
+def test_render_timeout() -> None:
+    raw = "import os\n" * 1000
+
+    assert highlight.render(raw, "python", wall_time=0.001) == (
+        highlight.render(raw, "text")
+    )
+    assert highlight.render(raw, "python", cpu_time=0.001) == (
+        highlight.render(raw, "text")
+    )
+
+    # What was spent before the timeout is refunded
+    budget = highlight.Budget(configuration.paste_size)
+    highlight.render(raw, "python", budget=budget, wall_time=0.001)
+
+    expected = highlight.Budget(configuration.paste_size)
+    highlight.render(raw, "text", budget=expected)
+
+    assert budget.total + budget.pending == expected.total + expected.pending
+
+
+def test_render_many_timeout() -> None:
+    raw = "import os\n" * 1000
+
+    with unittest.mock.patch.object(
+        configuration, "_highlight_wall_time", 0.001
+    ):
+        fmts = asyncio.run(
+            highlight.HighlightManager.render_many([(raw, "python", None)])
+        )
+
+    assert fmts == [highlight.render(raw, "text")]
+
+
+def test_render_broken_pool() -> None:
+    budgets = highlight.HighlightManager.get_budgets()
+    slot = highlight.HighlightManager._slots.pop()
+    budgets[slot] = 0
+
+    attempts = []
+
+    def render(
+        raw: str,
+        lexer: str,
+        filename: Optional[str],
+        budget: Optional[highlight.Budget],
+        *limits: Optional[float],
+    ) -> str:
+        attempts.append((lexer, budget, budgets[slot]))
+
+        # Spent before the process running the job was ended
+        budgets[slot] = 1000
+        raise BrokenProcessPool()
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+            1
+        ) as executor, unittest.mock.patch.object(
+            highlight.HighlightManager, "get_executor", return_value=executor
+        ), unittest.mock.patch.object(
+            highlight, "render", side_effect=render
+        ), pytest.raises(
+            BrokenProcessPool
+        ):
+            asyncio.run(
+                highlight.HighlightManager.render(
+                    "a", "python", budget=highlight.Budget(100, slot)
+                )
+            )
+    finally:
+        highlight.HighlightManager._slots.append(slot)
+
+    # Two attempts and the fallback to text, each starts without what the
+    # one before it spent and keeps the budget
+    assert [lexer for lexer, _, _ in attempts] == ["python", "python", "text"]
+    assert [spent for _, _, spent in attempts] == [0, 0, 0]
+    assert all(budget is not None for _, budget, _ in attempts)
+
+
+def test_render_too_large() -> None:
+    with pytest.raises(error.ValidationError):
+        asyncio.run(
+            highlight.HighlightManager.render(
+                "a" * (configuration.paste_size + 1), "text"
+            )
+        )
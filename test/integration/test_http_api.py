@@ -283,6 +283,19 @@ class DeprecatedAPITestCase(tornado.testing.AsyncHTTPTestCase):
         assert response.code == 200
         assert json.loads(response.body) == utility.list_languages()
 
+    def test_api_get_lexers_not_modified(self) -> None:
+        response = self.fetch("/json/lexers", method="GET")
+
+        assert response.code == 200
+
+        response = self.fetch(
+            "/json/lexers",
+            method="GET",
+            headers={"If-None-Match": response.headers["Etag"]},
+        )
+
+        assert response.code == 304
+
     def test_api_get_expiries(self) -> None:
         response = self.fetch("/json/expiries", method="GET")
 
@@ -488,6 +501,20 @@ class APIv1TestCase(tornado.testing.AsyncHTTPTestCase):
         response = self.fetch("/api/v1/paste")
         assert response.code == 405
 
+    def test_api_get_lexers_not_modified(self) -> None:
+        response = self.fetch("/api/v1/lexer", method="GET")
+
+        assert response.code == 200
+        assert json.loads(response.body) == utility.list_languages()
+
+        response = self.fetch(
+            "/api/v1/lexer",
+            method="GET",
+            headers={"If-None-Match": response.headers["Etag"]},
+        )
+
+        assert response.code == 304
+
     def test_api_detail_many_files(self) -> None:
         response = self.fetch(
             "/api/v1/paste",
@@ -524,3 +551,61 @@ class APIv1TestCase(tornado.testing.AsyncHTTPTestCase):
         assert data["files"][0]["name"] == "spam"
         assert data["files"][0]["content"] == "a"
         assert data["files"][0]["lexer"] == "c"
+
+    def test_api_detail_lines(self) -> None:
+        response = self.fetch(
+            "/api/v1/paste",
+            method="POST",
+            body=json.dumps(
+                {
+                    "expiry": "1day",
+                    "files": [
+                        {"content": "a\nb\nc\n", "lexer": "c"},
+                        {"content": "d", "lexer": "c"},
+                    ],
+                }
+            ),
+        )
+
+        name = json.loads(response.body)["link"].split("/")[-1]
+
+        response = self.fetch(f"/api/v1/paste/{name}?lines=2-3", method="GET")
+        files = json.loads(response.body)["files"]
+
+        assert response.code == 200
+        assert files[0]["content"] == "b\nc\n"
+        assert files[1]["content"] == ""
+
+        response = self.fetch(f"/api/v1/paste/{name}?lines=3-2", method="GET")
+
+        assert response.code == 400
+
+    def test_api_detail_not_modified(self) -> None:
+        response = self.fetch(
+            "/api/v1/paste",
+            method="POST",
+            body=json.dumps(
+                {
+                    "expiry": "1day",
+                    "files": [
+                        {"name": "spam", "content": "a", "lexer": "c"},
+                    ],
+                }
+            ),
+        )
+
+        name = json.loads(response.body)["link"].split("/")[-1]
+
+        response = self.fetch(f"/api/v1/paste/{name}", method="GET")
+
+        assert response.code == 200
+        assert "Last-Modified" in response.headers
+        assert "Cache-Control" in response.headers
+
+        response = self.fetch(
+            f"/api/v1/paste/{name}",
+            method="GET",
+            headers={"If-None-Match": response.headers["Etag"]},
+        )
+
+        assert response.code == 304
@@ -3,9 +3,14 @@ import unittest.mock
 import tornado.testing
 import tornado.web
 import copy
+import gzip
+import io
+import json
+import zipfile
+import zlib
 
 from pinnwand.configuration import Configuration, ConfigurationProvider
-from pinnwand import app
+from pinnwand import app, cache, compress, highlight
 from pinnwand.database import manager, utils as database_utils
 
 configuration: Configuration = ConfigurationProvider.get_config()
@@ -90,6 +95,18 @@ class WebsiteTestCase(tornado.testing.AsyncHTTPTestCase):
 
         assert response.code == 404
 
+    def test_website_show_not_a_slug(self) -> None:
+        with unittest.mock.patch.object(
+            manager.DatabaseManager, "run"
+        ) as patched:
+            response = self.fetch(
+                "/wp-login.php",
+                method="GET",
+            )
+
+        assert response.code == 404
+        assert not patched.called
+
     def test_website_raw_nonexistent_paste(self) -> None:
         response = self.fetch(
             "/raw/doesntexist",
@@ -306,6 +323,30 @@ class WebsiteTestCase(tornado.testing.AsyncHTTPTestCase):
 
         assert response.code == 200
 
+    def test_website_create_post_spam(self) -> None:
+        with unittest.mock.patch.object(
+            highlight.HighlightManager, "render_many"
+        ) as render_many:
+            response = self.fetch(
+                "/create",
+                method="POST",
+                headers={"Cookie": "_xsrf=dummy"},
+                body=urllib.parse.urlencode(
+                    {
+                        "_xsrf": "dummy",
+                        "expiry": "1day",
+                        "filename": ["a", "b"],
+                        "raw": ["a", "https://example.com " * 16],
+                        "lexer": ["python", "text"],
+                    },
+                    True,
+                ),
+            )
+
+        assert response.code == 451
+        # Spam is refused before it is ever highlighted
+        render_many.assert_not_called()
+
     def test_website_create_post_many(self) -> None:
         response = self.fetch(
             "/create",
@@ -500,6 +541,386 @@ class DeprecatedWebsiteTestCase(tornado.testing.AsyncHTTPTestCase):
 
         assert response.code == 200
 
+    def test_website_show_cached(self) -> None:
+        response = self.fetch(
+            "/",
+            method="POST",
+            body=urllib.parse.urlencode(
+                {"lexer": "c", "code": "a", "expiry": "1day"}
+            ),
+            follow_redirects=False,
+        )
+
+        removal = (
+            response.headers["Set-Cookie"].split(";")[0].split("=")[1].strip()
+        )
+        paste = response.headers["Location"].split("/")[-1]
+
+        for encoding in ("gzip", "identity", "gzip"):
+            response = self.fetch(
+                f"/{paste}",
+                method="GET",
+                headers={
+                    "Accept-Encoding": encoding,
+                    "Cookie": f"removal={removal}",
+                },
+                decompress_response=False,
+            )
+
+            assert response.code == 200
+            assert response.headers["Vary"] == "Accept-Encoding"
+
+            if encoding == "gzip":
+                assert response.headers["Content-Encoding"] == "gzip"
+                body = gzip.decompress(response.body)
+            else:
+                assert "Content-Encoding" not in response.headers
+                body = response.body
+
+            # The shared page doesn't contain anybody's removal id
+            assert removal.encode() not in body
+            assert b"Remove now" in body
+
+        assert cache.PageCache.get(paste, "show", "gzip") is not None
+        assert cache.PageCache.get(paste, "show", "identity") is not None
+
+    def test_website_not_modified(self) -> None:
+        response = self.fetch(
+            "/",
+            method="POST",
+            body=urllib.parse.urlencode(
+                {"lexer": "c", "code": "a", "expiry": "1day"}
+            ),
+            follow_redirects=False,
+        )
+
+        paste = response.headers["Location"].split("/")[-1]
+
+        for path in (
+            f"/{paste}",
+            f"/raw/{paste}",
+            f"/hex/{paste}",
+            f"/download/{paste}",
+            f"/download-archive/{paste}",
+        ):
+            response = self.fetch(path, method="GET")
+
+            assert response.code == 200
+            assert 0 < int(response.headers["Cache-Control"][8:]) <= 86400
+
+            etag = response.headers["Etag"]
+            last_modified = response.headers["Last-Modified"]
+
+            # Pages and archives can change without their paste changing
+            assert etag.startswith("W/") == (
+                path == f"/{paste}" or path.startswith("/download-archive/")
+            )
+
+            # Neither the cache nor the database have to provide any text
+            cache.invalidate(paste)
+            cache.MissingCache.discard(paste)
+
+            with unittest.mock.patch.object(
+                cache, "paste_by_slug"
+            ) as paste_by_slug, unittest.mock.patch.object(
+                cache, "file_by_slug"
+            ) as file_by_slug:
+                response = self.fetch(
+                    path, method="GET", headers={"If-None-Match": etag}
+                )
+                assert response.code == 304
+
+                response = self.fetch(
+                    path,
+                    method="GET",
+                    headers={"If-Modified-Since": last_modified},
+                )
+                assert response.code == 304
+
+            assert not paste_by_slug.called
+            assert not file_by_slug.called
+
+            response = self.fetch(
+                path, method="GET", headers={"If-None-Match": '"nope"'}
+            )
+            assert response.code == 200
+
+    def test_website_uncached_compression(self) -> None:
+        response = self.fetch(
+            "/",
+            method="POST",
+            body=urllib.parse.urlencode(
+                {"lexer": "c", "code": "a" * 1000, "expiry": "1day"}
+            ),
+            follow_redirects=False,
+        )
+
+        paste = response.headers["Location"].split("/")[-1]
+
+        with unittest.mock.patch.object(
+            configuration, "_cache_size", 0
+        ), unittest.mock.patch.object(
+            compress, "content_encode", wraps=compress.content_encode
+        ) as content_encode:
+            for path in (f"/{paste}", f"/raw/{paste}"):
+                response = self.fetch(
+                    path,
+                    method="GET",
+                    headers={"Accept-Encoding": "gzip"},
+                    decompress_response=False,
+                )
+
+                assert response.code == 200
+                assert response.headers["Content-Encoding"] == "gzip"
+                assert gzip.decompress(response.body)
+
+        # Bodies that aren't cached get a fast level
+        assert content_encode.call_count == 2
+        assert all(
+            call.args[2] is False for call in content_encode.call_args_list
+        )
+
+    def test_website_raw_only(self) -> None:
+        response = self.fetch(
+            "/",
+            method="POST",
+            body=urllib.parse.urlencode(
+                {"lexer": "c", "code": "a", "expiry": "1day"}
+            ),
+            follow_redirects=False,
+        )
+
+        paste = response.headers["Location"].split("/")[-1]
+
+        for path in (
+            f"/raw/{paste}",
+            f"/hex/{paste}",
+            f"/download/{paste}",
+            f"/download-archive/{paste}",
+        ):
+            response = self.fetch(path, method="GET")
+            assert response.code == 200
+
+        # None of these loaded the highlighted text
+        file = cache.PasteCache.get_file(paste)
+        assert file is not None
+        assert "fmt_text" not in file.__dict__
+
+        archived = cache.PasteCache.get(paste, fmt=False)
+        assert archived is not None
+        assert all("fmt_text" not in file.__dict__ for file in archived.files)
+
+        assert cache.PasteCache.get(paste) is None
+
+    def test_website_raw_compressed(self) -> None:
+        with unittest.mock.patch.object(
+            configuration, "_storage_compression", "zlib"
+        ):
+            response = self.fetch(
+                "/",
+                method="POST",
+                body=urllib.parse.urlencode(
+                    {"lexer": "c", "code": "a" * 100, "expiry": "1day"}
+                ),
+                follow_redirects=False,
+            )
+
+        paste = response.headers["Location"].split("/")[-1]
+
+        for path in (f"/raw/{paste}", f"/download/{paste}"):
+            response = self.fetch(
+                path,
+                method="GET",
+                headers={"Accept-Encoding": "deflate"},
+                decompress_response=False,
+            )
+
+            assert response.code == 200
+            assert response.headers["Content-Encoding"] == "deflate"
+            assert response.headers["Vary"] == "Accept-Encoding"
+            assert zlib.decompress(response.body) == b"a" * 100
+
+            etag = response.headers["Etag"]
+
+            response = self.fetch(
+                path,
+                method="GET",
+                headers={"Accept-Encoding": "identity"},
+                decompress_response=False,
+            )
+
+            assert response.code == 200
+            assert "Content-Encoding" not in response.headers
+            assert response.body == b"a" * 100
+            assert response.headers["Etag"] != etag
+
+    def test_website_download_paste(self) -> None:
+        response = self.fetch(
+            "/api/v1/paste",
+            method="POST",
+            body=json.dumps(
+                {
+                    "expiry": "1day",
+                    "files": [
+                        {"lexer": "c", "content": "a" * 1000},
+                        {"lexer": "c", "content": "b", "name": "b.c"},
+                    ],
+                }
+            ),
+        )
+
+        paste = json.loads(response.body)["link"].split("/")[-1]
+
+        responses = [
+            self.fetch(f"/download-archive/{paste}", method="GET")
+            for _ in range(2)
+        ]
+
+        assert responses[0].code == 200
+        assert responses[0].headers["Content-Type"] == "application/zip"
+        assert responses[0].body == responses[1].body
+
+        with zipfile.ZipFile(io.BytesIO(responses[0].body)) as zf:
+            assert zf.testzip() is None
+
+            infos = zf.infolist()
+
+            assert len(infos) == 2
+            assert all(
+                info.compress_type == zipfile.ZIP_DEFLATED for info in infos
+            )
+            assert zf.read(infos[0]) == b"a" * 1000
+            assert infos[0].compress_size < 1000
+            assert infos[1].filename.startswith("b-")
+            assert zf.read(infos[1]) == b"b"
+
+    def test_website_raw_range(self) -> None:
+        response = self.fetch(
+            "/",
+            method="POST",
+            body=urllib.parse.urlencode(
+                {"lexer": "c", "code": "0123456789", "expiry": "1day"}
+            ),
+            follow_redirects=False,
+        )
+
+        paste = response.headers["Location"].split("/")[-1]
+
+        for path in (f"/raw/{paste}", f"/download/{paste}"):
+            response = self.fetch(
+                path,
+                method="GET",
+                headers={"Accept-Encoding": "gzip", "Range": "bytes=-3"},
+                decompress_response=False,
+            )
+
+            assert response.code == 206
+            assert response.headers["Accept-Ranges"] == "bytes"
+            assert response.headers["Content-Range"] == "bytes 7-9/10"
+            assert "Content-Encoding" not in response.headers
+            assert response.body == b"789"
+
+            etag = response.headers["Etag"]
+            last_modified = response.headers["Last-Modified"]
+
+            for validator in (etag, last_modified):
+                response = self.fetch(
+                    path,
+                    method="GET",
+                    headers={"Range": "bytes=2-3", "If-Range": validator},
+                )
+
+                assert response.code == 206
+                assert response.body == b"23"
+
+            response = self.fetch(
+                path,
+                method="GET",
+                headers={"Range": "bytes=2-3", "If-Range": '"outdated"'},
+            )
+
+            assert response.code == 200
+            assert response.body == b"0123456789"
+
+            response = self.fetch(
+                path, method="GET", headers={"Range": "bytes=10-"}
+            )
+
+            assert response.code == 416
+            assert response.headers["Content-Range"] == "bytes */10"
+
+    def test_website_raw_lines(self) -> None:
+        response = self.fetch(
+            "/",
+            method="POST",
+            body=urllib.parse.urlencode(
+                {
+                    "lexer": "c",
+                    "code": "".join(f"{line}\n" for line in range(1, 301)),
+                    "expiry": "1day",
+                }
+            ),
+            follow_redirects=False,
+        )
+
+        paste = response.headers["Location"].split("/")[-1]
+
+        response = self.fetch(f"/raw/{paste}?lines=100-102", method="GET")
+
+        assert response.code == 200
+        assert response.body == b"100\n101\n102\n"
+
+        etag = response.headers["Etag"]
+
+        response = self.fetch(
+            f"/raw/{paste}?lines=100-102",
+            method="GET",
+            headers={"If-None-Match": etag},
+        )
+
+        assert response.code == 304
+
+        response = self.fetch(f"/raw/{paste}?lines=299-", method="GET")
+
+        assert response.body == b"299\n300\n"
+        assert response.headers["Etag"] != etag
+
+        response = self.fetch(f"/raw/{paste}?lines=0", method="GET")
+
+        assert response.code == 400
+
+    def test_website_raw_gzip(self) -> None:
+        response = self.fetch(
+            "/",
+            method="POST",
+            body=urllib.parse.urlencode(
+                {"lexer": "c", "code": "a" * 100, "expiry": "1day"}
+            ),
+            follow_redirects=False,
+        )
+
+        paste = response.headers["Location"].split("/")[-1]
+
+        for path in (f"/raw/{paste}", f"/download/{paste}"):
+            response = self.fetch(
+                path,
+                method="GET",
+                headers={"Accept-Encoding": "gzip"},
+                decompress_response=False,
+            )
+
+            assert response.code == 200
+            assert response.headers["Content-Encoding"] == "gzip"
+            assert gzip.decompress(response.body) == b"a" * 100
+
+        # Compressed once for both
+        assert cache.PageCache.get(paste, f"raw:{paste}", "gzip") is not None
+
+        response = self.fetch(f"/{paste}", method="GET")
+
+        assert response.code == 200
+        assert b"a" * 100 in response.body
+
     def test_website_raw(self) -> None:
         response = self.fetch(
             "/",
@@ -652,6 +1073,48 @@ class DeprecatedWebsiteTestCase(tornado.testing.AsyncHTTPTestCase):
             method="GET",
         )
         assert response.code == 200
+        assert response.body.startswith(b"00000000  61 ")
+
+    def test_website_hex_window(self) -> None:
+        response = self.fetch(
+            "/",
+            method="POST",
+            body=urllib.parse.urlencode(
+                {"lexer": "c", "code": "a" * 10000, "expiry": "1day"}
+            ),
+            follow_redirects=False,
+        )
+
+        paste = response.headers["Location"].split("/")[-1]
+
+        response = self.fetch(f"/hex/{paste}", method="GET")
+        lines = response.body.decode().splitlines()
+
+        assert len(lines) == 625
+        assert lines[-1].startswith("00002700  ")
+
+        # Windows are cut from the encoded text that is kept around
+        assert cache.PageCache.get(paste, f"raw:{paste}", "identity")
+
+        response = self.fetch(f"/hex/{paste}?offset=32&length=40")
+        lines = response.body.decode().splitlines()
+
+        assert response.code == 200
+        assert [line[:8] for line in lines] == [
+            "00000020",
+            "00000030",
+            "00000040",
+        ]
+        assert lines[-1].endswith("|aaaaaaaa|")
+
+        response = self.fetch(f"/hex/{paste}?offset=20000")
+
+        assert response.code == 200
+        assert response.body == b""
+
+        for query in ("offset=-1", "length=a"):
+            response = self.fetch(f"/hex/{paste}?{query}")
+            assert response.code == 400
 
     def test_website_download_nonexistent_paste(self) -> None:
         response = self.fetch(
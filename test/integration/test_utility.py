@@ -1,3 +1,6 @@
+import itertools
+import unittest.mock
+
 import pytest
 
 from pinnwand import utility
@@ -97,6 +100,69 @@ def test_guess_language() -> None:
     )
 
 
+def test_guess_language_declared() -> None:
+    # shebang
+    assert utility.guess_language("#!/usr/bin/env python3\nfoo()") == "python"
+    assert utility.guess_language("#!/usr/bin/env -S node\nfoo()") == (
+        "javascript"
+    )
+    assert utility.guess_language("#!/bin/sh\nfoo", "a.txt") == "bash"
+
+    # modelines
+    assert utility.guess_language("# -*- mode: ruby -*-\nfoo") == "ruby"
+    assert utility.guess_language("/* -*- C++ -*- */\nfoo") == "cpp"
+    assert utility.guess_language("foo\n" * 100 + "# vim: set ft=perl:") == (
+        "perl"
+    )
+    assert utility.guess_language("# -*- coding: utf-8 -*-\n", "a.py") == (
+        "python"
+    )
+
+    # unknown names are ignored
+    assert utility.guess_language("#!/opt/nothing\nfoo", "a.py") == "python"
+
+
+def test_guess_language_filename() -> None:
+    # A filename that belongs to a single language decides
+    assert utility.guess_language("foo", "a.py") == "python"
+    assert utility.guess_language("foo", "Makefile") == "make"
+
+    with unittest.mock.patch.object(
+        utility, "guess_lexer_for_filename"
+    ) as patched:
+        utility.guess_language("foo", "a.rs")
+
+    assert not patched.called
+
+
+def test_guess_language_cheap() -> None:
+    # Pygments doesn't have to analyse text that declares its language or
+    # has a filename of a single language
+    with unittest.mock.patch.object(
+        utility, "guess_lexer", wraps=utility.guess_lexer
+    ) as guess_lexer, unittest.mock.patch.object(
+        utility,
+        "guess_lexer_for_filename",
+        wraps=utility.guess_lexer_for_filename,
+    ) as guess_lexer_for_filename:
+        for raw, filename in (
+            ("#!/usr/bin/env python3\nfoo()", None),
+            ("# -*- mode: ruby -*-\nfoo", None),
+            ("foo\n" * 100 + "# vim: set ft=perl:", None),
+            ("foo", "a.py"),
+            ("#!/opt/nothing\nfoo", "a.py"),
+        ):
+            utility.guess_language(raw, filename)
+
+        assert not guess_lexer.called
+        assert not guess_lexer_for_filename.called
+
+        # Text that gives nothing away is still analysed
+        utility.guess_language("int main(void) { return 0; }")
+
+        assert guess_lexer.called
+
+
 @pytest.mark.parametrize(
     "path,result",
     [
@@ -135,5 +201,167 @@ def test_slug_context() -> None:
             )
 
 
-# TODO assert raises RuntimeError for dont_use
-# TODO assert raises RuntimeError for database
+def test_slug_context_reserve() -> None:
+    with manager.DatabaseManager.get_session() as session:
+        paste = models.Paste("AAAA")
+        session.add(paste)
+        session.commit()
+
+        candidates = iter(["AAAA", "BBBB", "CCCC", "BBBB", "DDDD"])
+
+        with unittest.mock.patch.object(
+            utility, "hash_create", lambda _: next(candidates)
+        ):
+            with utility.SlugContext(True, session) as slug_context:
+                slug_context.reserve(3)
+
+                assert sorted(next(slug_context) for _ in range(3)) == [
+                    "BBBB",
+                    "CCCC",
+                    "DDDD",
+                ]
+
+        session.delete(paste)
+        session.commit()
+
+
+def test_object_count() -> None:
+    utility.ObjectCount.reset()
+
+    with manager.DatabaseManager.get_session() as session:
+        count = utility.ObjectCount.get(session)
+
+        assert count == (
+            session.query(models.Paste).count()
+            + session.query(models.File).count()
+        )
+
+        utility.ObjectCount.add(3)
+        assert utility.ObjectCount.get(session) == count + 3
+
+        utility.ObjectCount.add(-(count + 10))
+        assert utility.ObjectCount.get(session) == 0
+
+    utility.ObjectCount.reset()
+
+
+def test_reap() -> None:
+    utility.reap()
+
+    with manager.DatabaseManager.get_session() as session:
+        for slug in ("REAPA", "REAPB"):
+            paste = models.Paste(slug, expiry=-1)
+            paste.files.append(models.File(slug, "reap me", "text"))
+            session.add(paste)
+
+        session.commit()
+
+    configuration: Configuration = ConfigurationProvider.get_config()
+
+    # Make sure the pastes are reaped over multiple batches
+    with unittest.mock.patch.multiple(
+        configuration, _reaping_batch_size=1, _reaping_batch_pause=0
+    ):
+        pastes, files, size = utility.reap()
+
+    assert pastes == 2
+    assert files == 2
+    assert size > 2 * len("reap me")
+
+    with manager.DatabaseManager.get_session() as session:
+        assert (
+            not session.query(models.Paste)
+            .filter(models.Paste.slug.in_(["REAPA", "REAPB"]))
+            .all()
+        )
+        assert (
+            not session.query(models.File)
+            .filter(models.File.slug.in_(["REAPA", "REAPB"]))
+            .all()
+        )
+
+
+def test_slugs_create_exhausted() -> None:
+    with manager.DatabaseManager.get_session() as session:
+        # A slug space of two slugs can't provide three
+        with unittest.mock.patch.object(
+            utility, "hash_create", side_effect=itertools.cycle("AB")
+        ), pytest.raises(RuntimeError):
+            utility.slugs_create(session, 3)
+
+        with unittest.mock.patch.object(
+            utility, "hash_create", return_value="A"
+        ), pytest.raises(RuntimeError):
+            utility.slugs_create(session, 1, dont_use=["A"])
+
+        paste = models.Paste("EXHAUSTED", expiry=3600)
+        session.add(paste)
+        session.commit()
+
+        with unittest.mock.patch.object(
+            utility, "hash_create", return_value="EXHAUSTED"
+        ), pytest.raises(RuntimeError):
+            utility.slugs_create(session, 1)
+
+
+def test_accepts_encoding() -> None:
+    assert utility.accepts_encoding("gzip, deflate, br", "gzip")
+    assert utility.accepts_encoding("GZIP;q=0.5", "gzip")
+    assert utility.accepts_encoding("*", "gzip")
+    assert not utility.accepts_encoding("", "gzip")
+    assert not utility.accepts_encoding("deflate", "gzip")
+    assert not utility.accepts_encoding("gzip;q=0", "gzip")
+    assert not utility.accepts_encoding("*, gzip;q=0", "gzip")
+
+
+def test_parse_range() -> None:
+    assert utility.parse_range("bytes=0-9", 100) == (0, 10)
+    assert utility.parse_range("bytes=90-", 100) == (90, 100)
+    assert utility.parse_range("bytes=90-200", 100) == (90, 100)
+    assert utility.parse_range("bytes=-10", 100) == (90, 100)
+    assert utility.parse_range("bytes=-200", 100) == (0, 100)
+
+    # Unsatisfiable
+    assert utility.parse_range("bytes=100-", 100) == (100, 100)
+    assert utility.parse_range("bytes=-0", 100) == (100, 100)
+    assert utility.parse_range("bytes=0-", 0) == (0, 0)
+
+    # Ignored
+    assert utility.parse_range("bytes=0-1,5-6", 100) is None
+    assert utility.parse_range("bytes=9-0", 100) is None
+    assert utility.parse_range("bytes=a-", 100) is None
+    assert utility.parse_range("lines=0-9", 100) is None
+
+
+def test_line_index() -> None:
+    text = "a\nbb\r\nccc"
+    index = utility.line_index(text)
+
+    assert len(index) == 12
+    assert utility.line_slice(text, index, 1, 1) == "a\n"
+    assert utility.line_slice(text, index, 2, 3) == "bb\r\nccc"
+    assert utility.line_slice(text, index, 3, 10) == "ccc"
+    assert utility.line_slice(text, index, 2) == "bb\r\nccc"
+    assert utility.line_slice(text, index, 4) == ""
+
+    # A final newline doesn't start another line
+    assert len(utility.line_index("a\n")) == 4
+
+
+def test_parse_lines() -> None:
+    assert utility.parse_lines("100-200") == (100, 200)
+    assert utility.parse_lines("100-") == (100, None)
+    assert utility.parse_lines("100") == (100, 100)
+
+    for value in ("", "0", "0-1", "2-1", "-5", "a-b", "1-2-3"):
+        with pytest.raises(ValueError):
+            utility.parse_lines(value)
+
+
+def test_hexdump() -> None:
+    assert utility.hexdump(b"") == ""
+    assert utility.hexdump(b"abcdefghijklmnopq\x00\n", 16) == (
+        "00000010  61 62 63 64 65 66 67 68  69 6a 6b 6c 6d 6e 6f 70"
+        "  |abcdefghijklmnop|\n"
+        "00000020  71 00 0a" + " " * 42 + "|q..|\n"
+    )